@@ -56,9 +56,24 @@ def parse_args():
         help="Remove all cached data.",
     )
     nbuild_parser.add_argument(
-        'manifest',
+        '--offline',
+        action='store_true',
+        help="Never use the network. Only the caches and the local mirror are used to fetch the inputs of a build.",
+    )
+    nbuild_parser.add_argument(
+        '--prefetch',
+        action='store_true',
+        help="Download the inputs of the given build manifests in the caches, without building anything.",
+    )
+    nbuild_parser.add_argument(
+        '--check-patches',
+        action='store_true',
+        help="Check that the patches of the given build manifest apply cleanly on all its versions, in parallel, without building anything.",
+    )
+    nbuild_parser.add_argument(
+        'manifests',
         metavar='MANIFEST_PATH',
-        nargs='?',
+        nargs='*',
     )
     nbuild_parser.add_argument(
         '-v',
@@ -69,6 +84,13 @@ def parse_args():
     )
     nbuild_args = nbuild_parser.parse_args()
 
+    # The build manifest being loaded. Several build manifests can only be given with --prefetch
+    nbuild_args.manifest = nbuild_args.manifests[0] if len(nbuild_args.manifests) > 0 else None
+
+    # Caches are also used by worker threads while the main one changes its working directory
+    nbuild_args.cache_dir = os.path.abspath(nbuild_args.cache_dir)
+    nbuild_args.output_dir = os.path.abspath(nbuild_args.output_dir)
+
 
 def get_args():
     """Return an object holding the values of each command line argument.
@@ -46,6 +46,107 @@ def get_download_cache(build) -> str:
     )
 
 
+def get_content_cache() -> str:
+    """Get the path pointing to the cache where downloaded files are stored by content, regardless of the build that downloaded them.
+
+    Files are stored under their SHA256, allowing any build to reuse a file downloaded by another one, as long as the SHA256 of the
+    file is known. The download cache of each build is a view of this cache, made of links to the files it contains.
+
+    :info: This cache is kept across builds to avoid downloading the same files over and over
+    :returns: The path pointing to the cache where downloaded files are stored by content
+    """
+    return os.path.join(
+        core.args.get_args().cache_dir,
+        'content',
+    )
+
+
+def get_content_path(sha256: str) -> str:
+    """Get the path pointing to the file of the content cache holding the data with the given SHA256.
+
+    :param sha256: The SHA256 of the data
+    :returns: The path pointing to the file holding the data with the given SHA256. The file may not exist.
+    """
+    return os.path.join(
+        get_content_cache(),
+        sha256[:2],
+        sha256,
+    )
+
+
+def get_git_cache() -> str:
+    """Get the path pointing to the cache where the mirrors of the fetched git repositories are stored.
+
+    :info: This cache is kept across builds to avoid cloning the same repositories over and over
+    :returns: The path pointing to the cache where the mirrors of git repositories are stored
+    """
+    return os.path.join(
+        core.args.get_args().cache_dir,
+        'git',
+    )
+
+
+def get_patch_cache() -> str:
+    """Get the path pointing to the cache where the results of applying patch series are recorded.
+
+    :info: This cache is kept across builds to avoid checking the same patches against the same source code over and over
+    :returns: The path pointing to the cache where the results of applying patch series are recorded
+    """
+    return os.path.join(
+        core.args.get_args().cache_dir,
+        'patch',
+    )
+
+
+def get_snapshot_cache(build) -> str:
+    """Get the path pointing to the cache where the snapshots of the prepared source code of the given build are stored.
+
+    :info: This cache is kept across builds to avoid extracting and patching the same source code over and over
+    :param build: The build associated with the cache
+    :type build: :py:class:`.Build`
+
+    :returns: The path pointing to the cache where the snapshots of the given build are stored
+    """
+    return os.path.join(
+        core.args.get_args().cache_dir,
+        'snapshot',
+        build.manifest.metadata.name,
+        build.semver,
+    )
+
+
+def get_extract_cache(build) -> str:
+    """Get the path pointing to the cache where the tarballs of the given build are extracted while they are downloaded.
+
+    :param build: The build associated with the cache
+    :type build: :py:class:`.Build`
+
+    :returns: The path pointing to the cache where the tarballs of the given build are extracted while they are downloaded
+    """
+    return os.path.join(
+        core.args.get_args().cache_dir,
+        'extract',
+        build.manifest.metadata.name,
+        build.semver,
+    )
+
+
+def get_log_path(build) -> str:
+    """Get the path pointing to the compressed file where the output of the commands executed by the given build is written.
+
+    :param build: The build associated with the log file
+    :type build: :py:class:`.Build`
+
+    :returns: The path pointing to the log file of the given build
+    """
+    return os.path.join(
+        core.args.get_args().cache_dir,
+        'log',
+        build.manifest.metadata.name,
+        f'{build.semver}.log.gz',
+    )
+
+
 def get_build_cache(build) -> str:
     """Get the path pointing to the cache where the given build should be built.
 
@@ -100,8 +201,25 @@ def get_package_cache(package) -> str:
     )
 
 
+def get_report_path(build) -> str:
+    """Get the path pointing to the report of the resources used by the commands of the given build.
+
+    :info: The report is written by :py:func:`~stdlib.usage.write_report`, next to the NPF of the package named after the build manifest
+    :param build: The build associated with the report
+    :type build: :py:class:`.Build`
+
+    :returns: The path pointing to the report of the resources used by the commands of the given build
+    """
+    return os.path.join(
+        core.args.get_args().output_dir,
+        build.manifest.metadata.category,
+        build.manifest.metadata.name,
+        f'{build.manifest.metadata.name}-{build.semver}.usage.toml',
+    )
+
+
 def purge_cache():
-    """Purge the content of the `wrap`, `build`, `download` and `install` cache for all builds."""
+    """Purge the content of the `wrap`, `build`, `download`, `content`, `git`, `patch`, `snapshot`, `extract`, `log` and `install` cache for all builds."""
     folder = core.args.get_args().cache_dir
 
     for file in os.listdir(folder):
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3.6
+# -*- coding: utf-8 -*-
+"""Functions to copy files from the caches to the build caches as cheaply as the file system allows.
+
+Each file is copied using the first of these methods that works:
+
+  * ``reflink``: The copy shares the data of the source until one of them is modified (``FICLONE``, on btrfs or xfs for example).
+  * ``copy_file_range``: The data is copied by the kernel, which may share it too or offload it to the storage.
+  * ``sendfile``: The data is copied by the kernel, without going through the user space.
+  * ``copy``: The data is read and written back by this process.
+
+The functions return the method used, so the callers can report it.
+
+:note: Files are never hard linked: the copies are modified by the builds (by ``patch`` or ``sed -i`` for example), which would
+    modify the source too. Permission bits don't prevent it, as ``nbuild`` runs as root.
+"""
+
+import os
+import errno
+import fcntl
+import shutil
+import collections
+from typing import Dict
+
+# The number of the FICLONE ioctl, from <linux/fs.h>
+_FICLONE = 0x40049409
+
+_COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def copy_file(
+    src: str,
+    dst: str,
+) -> str:
+    """Copy the file pointed to by ``src`` to ``dst``, with its permission bits, last access time and last modification time.
+
+    ``dst`` is replaced if it already exists.
+
+    :param src: The path pointing to the file to copy.
+    :param dst: The path of the copy.
+    :returns: The method used to copy the file: ``reflink``, ``copy_file_range``, ``sendfile`` or ``copy``.
+    """
+    # Writing to an existing hard link would modify the file it is linked to too
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+    with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+        method = _copy_data(src_file.fileno(), dst_file.fileno())
+        if method is None:
+            shutil.copyfileobj(src_file, dst_file, _COPY_BUFFER_SIZE)
+            method = 'copy'
+
+    shutil.copystat(src, dst)
+    return method
+
+
+def copy_tree(
+    src: str,
+    dst: str,
+) -> Dict[str, int]:
+    """Recursively copy the directory pointed to by ``src`` to ``dst``, which must not exist, using :py:func:`.copy_file`.
+
+    :param src: The path pointing to the directory to copy.
+    :param dst: The path of the copy.
+    :returns: The number of files copied by each method.
+    """
+    methods = collections.Counter()
+
+    def copy_function(src, dst):
+        methods[copy_file(src, dst)] += 1
+
+    shutil.copytree(src, dst, copy_function=copy_function)
+    return dict(methods)
+
+
+def _copy_data(src_fd, dst_fd):
+    """Copy the content of ``src_fd`` to the empty file ``dst_fd`` with the cheapest method that works, except a plain copy.
+
+    :returns: The method used, or ``None`` if none of them works.
+    """
+    try:
+        fcntl.ioctl(dst_fd, _FICLONE, src_fd)
+        return 'reflink'
+    except OSError:
+        pass
+
+    size = os.fstat(src_fd).st_size
+    for (method, copy_chunk) in [('copy_file_range', _copy_file_range_chunk), ('sendfile', _sendfile_chunk)]:
+        try:
+            offset = 0
+            while offset < size:
+                copied = copy_chunk(src_fd, dst_fd, offset, size - offset)
+                if copied == 0:
+                    break  # The file was truncated in the meantime
+                offset += copied
+            return method
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF):
+                raise
+
+            # Start again from scratch with the next method
+            os.ftruncate(dst_fd, 0)
+            os.lseek(dst_fd, 0, os.SEEK_SET)
+    return None
+
+
+def _copy_file_range_chunk(src_fd, dst_fd, offset, count):
+    if not hasattr(os, 'copy_file_range'):
+        raise OSError(errno.ENOSYS, "copy_file_range() isn't available")
+    return os.copy_file_range(src_fd, dst_fd, count, offset, offset)
+
+
+def _sendfile_chunk(src_fd, dst_fd, offset, count):
+    os.lseek(dst_fd, offset, os.SEEK_SET)
+    return os.sendfile(dst_fd, src_fd, offset, count)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3.6
+# -*- coding: utf-8 -*-
+"""Functions to share network connections across the whole process."""
+
+import ftplib
+import threading
+import contextlib
+import requests
+import core.args
+import core.config
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+nbuild_sessions = dict()  # Key = Whether the session retries failed requests, Value = The session
+nbuild_session_lock = threading.Lock()
+
+nbuild_ftp_connections = dict()  # Key = A tuple made of a host, a port and a user, Value = A list of idle FTP connections
+nbuild_ftp_connections_lock = threading.Lock()
+
+
+def get_session(retries: bool = True) -> requests.Session:
+    """Return the HTTP session shared by the whole process, creating it the first time this function is called.
+
+    The connections of the session are pooled per host and kept alive, so consecutive requests to the same host don't pay
+    the cost of a new TCP and TLS handshake. Requests that fail to connect or that receive a ``5xx`` status code are retried
+    with an exponentially growing delay, unless ``retries`` is ``False``.
+
+    The session can be tuned in the ``[network]`` section of the configuration file:
+
+        * ``retries``: The number of times a failed request is retried. The default value is ``3``.
+        * ``retry_delay``: The delay, in seconds, before the first retry. The default value is ``1``.
+        * ``pool_size``: The maximum number of connections kept alive per host. The default value is ``10``.
+
+    :note: The session is safe to use from multiple threads at the same time.
+    :param retries: ``False`` to get a session that never retries failed requests, for callers that retry them themselves (like
+        the downloads of :py:mod:`stdlib.fetch`), so the retries don't multiply. The default value is ``True``.
+    :returns: The HTTP session shared by the whole process.
+    """
+    with nbuild_session_lock:
+        if retries not in nbuild_sessions:
+            retry = Retry(
+                total=_get_network_config('retries', 3),
+                backoff_factor=_get_network_config('retry_delay', 1),
+                status_forcelist=(500, 502, 503, 504),
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                pool_maxsize=_get_network_config('pool_size', 10),
+                max_retries=retry if retries else 0,
+            )
+
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            nbuild_sessions[retries] = session
+
+    return nbuild_sessions[retries]
+
+
+@contextlib.contextmanager
+def ftp_connection(url_object):
+    """Borrow a logged-in FTP connection to the host of ``url_object`` (as returned by :py:func:`urllib.parse.urlparse`).
+
+    Connections are pooled per host and user, so consecutive transfers from the same host don't have to connect and log in again.
+    The connection is given back to the pool once the ``with`` block exits, unless an exception is raised, in which case it is closed.
+    At most ``pool_size`` (see :py:func:`.get_session`) idle connections are kept per host.
+
+    The user and password of ``url_object`` are used to log in, if any. Otherwise, it logs in anonymously.
+
+    :note: A connection is only used by one thread at a time, so it is safe to call this function from multiple threads at the same time.
+    """
+    key = (url_object.hostname, url_object.port or ftplib.FTP_PORT, url_object.username)
+    ftp = None
+
+    with nbuild_ftp_connections_lock:
+        idle_connections = nbuild_ftp_connections.setdefault(key, [])
+        if len(idle_connections) > 0:
+            ftp = idle_connections.pop()
+
+    # The server may have closed an idle connection in the meantime
+    if ftp is not None:
+        try:
+            ftp.voidcmd('NOOP')
+        except ftplib.all_errors:
+            ftp.close()
+            ftp = None
+
+    if ftp is None:
+        ftp = ftplib.FTP(timeout=get_timeout())
+        try:
+            ftp.connect(url_object.hostname, url_object.port or ftplib.FTP_PORT)
+            ftp.login(url_object.username or '', url_object.password or '')
+        except BaseException:
+            ftp.close()
+            raise
+
+    try:
+        yield ftp
+    except BaseException:
+        ftp.close()
+        raise
+
+    with nbuild_ftp_connections_lock:
+        if len(nbuild_ftp_connections[key]) < _get_network_config('pool_size', 10):
+            nbuild_ftp_connections[key].append(ftp)
+            ftp = None
+
+    if ftp is not None:
+        ftp.close()
+
+
+def get_timeout() -> float:
+    """Return the timeout, in seconds, to use when connecting or waiting for data.
+
+    It is the value of ``timeout`` in the ``[network]`` section of the configuration file, or ``60`` if there is none.
+    """
+    return _get_network_config('timeout', 60)
+
+
+def is_offline() -> bool:
+    """Return whether the network must not be used, as requested by the argument ``--offline``."""
+    args = core.args.get_args()
+    return args is not None and args.offline
+
+
+def _get_network_config(key, default):
+    return (core.config.get_config() or {}).get('network', {}).get(key, default)
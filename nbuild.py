@@ -9,6 +9,8 @@ import importlib.util
 import core.args
 import core.config
 import stdlib.log
+import stdlib.fetch
+import stdlib.manifest
 from multiprocessing import cpu_count
 
 
@@ -27,6 +29,10 @@ def main():
         stdlib.log.flog("No path to a build manifest given.")
         exit(1)
 
+    if len(core.args.get_args().manifests) > 1 and not core.args.get_args().prefetch:
+        stdlib.log.flog("Only one build manifest can be built at a time.")
+        exit(1)
+
     try:
         core.config.load_config()
     except Exception as e:
@@ -57,14 +63,21 @@ def main():
     if 'env' in core.config.get_config():
         os.environ.update(core.config.get_config()['env'])
 
-    manifest_path = core.args.get_args().manifest
-    spec = importlib.util.spec_from_file_location('build_manifest', manifest_path)
-    if not spec:
-        stdlib.log.flog(f"Failed to load Build Manifest located at path \"{manifest_path}\"")
-        exit(1)
+    for manifest_path in core.args.get_args().manifests:
+        core.args.get_args().manifest = manifest_path
+
+        spec = importlib.util.spec_from_file_location('build_manifest', manifest_path)
+        if not spec:
+            stdlib.log.flog(f"Failed to load Build Manifest located at path \"{manifest_path}\"")
+            exit(1)
+
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
 
-    module = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(module)
+    # Build manifests only register themselves when prefetching, so their inputs can all be downloaded at once
+    if core.args.get_args().prefetch:
+        builds = [build for manifest in stdlib.manifest.prefetched_manifests() for build in manifest.builds()]
+        stdlib.fetch.prefetch(builds)
 
 
 if __name__ == "__main__":
@@ -6,4 +6,4 @@
 from stdlib.license import License
 from stdlib.pushd import pushd
 from stdlib.pushenv import pushenv
-from stdlib.cmd import cmd
+from stdlib.cmd import cmd, cmd_async, gather
@@ -19,6 +19,26 @@ class Build():
 
     :param args: The arguments of this build. This is a subset of ``BuildManifest.versionized_args``,
         the one corresponding to the version of this build.
+
+    :ivar fetched: The inputs fetched in the build cache so far, as tuples made of the kind of the input (``url``, ``file`` or ``git``),
+        its path relative to the build cache and a string identifying its content (like its SHA256). They are added by the functions
+        of :py:mod:`stdlib.fetch`.
+    :vartype fetched: ``List`` [ ``Tuple`` [ ``str``, ``str``, ``str`` ] ]
+
+    :ivar extract_filters: The ``include`` and ``exclude`` filters given to :py:mod:`stdlib.fetch` for the tarballs of the build cache.
+        Keys are the paths of the tarballs, relative to the build cache, and values are dictionaries with the keys ``include`` and ``exclude``.
+        They are used by :py:func:`~stdlib.extract.extract_all` and :py:func:`~stdlib.extract.flat_extract_all`.
+    :vartype extract_filters: ``Dict`` [ ``str``, ``Dict`` [ ``str``, ``List`` [ ``str`` ] ] ]
+
+    :ivar staged_extractions: The tarballs of the build cache extracted by :py:mod:`stdlib.fetch` while they were downloaded.
+        Keys are the paths of the tarballs, relative to the build cache, and values are dictionaries with the keys ``path`` (the
+        directory of the extract cache they were extracted in), ``flat``, ``include`` and ``exclude``. They are moved to the build cache
+        by :py:func:`~stdlib.extract.extract_all` and :py:func:`~stdlib.extract.flat_extract_all`.
+    :vartype staged_extractions: ``Dict`` [ ``str``, ``Dict`` [ ``str``, ``Any`` ] ]
+
+    :ivar usage: The commands executed so far, as tuples made of the step they were executed in (or ``None``), the command and the
+        resources it used. They are added by :py:func:`~stdlib.cmd.cmd` and summed up by :py:func:`~stdlib.usage.write_report`.
+    :vartype usage: ``List`` [ ``Tuple`` [ ``str``, ``str``, :py:class:`~stdlib.usage.Usage` ] ]
     """
     def __init__(
         self,
@@ -31,10 +51,17 @@ class Build():
         self.semver = self.args['semver']
         self.major, self.minor, self.patch = self.args['semver'].split('.')
 
-        from core.cache import get_download_cache, get_build_cache, get_install_cache
+        from core.cache import get_download_cache, get_build_cache, get_install_cache, get_extract_cache, get_log_path
         self.download_cache = get_download_cache(self)
         self.build_cache = get_build_cache(self)
         self.install_cache = get_install_cache(self)
+        self.extract_cache = get_extract_cache(self)
+        self.log_path = get_log_path(self)
+
+        self.fetched = list()
+        self.extract_filters = dict()
+        self.staged_extractions = dict()
+        self.usage = list()
 
     def __str__(self):
         return f'''{self.manifest.metadata.name} ({self.semver})'''
@@ -60,6 +87,18 @@ class Build():
             shutil.rmtree(self.install_cache)
         os.makedirs(self.install_cache)
 
+        if os.path.exists(self.extract_cache):
+            shutil.rmtree(self.extract_cache)
+
+        os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+        if os.path.exists(self.log_path):
+            os.remove(self.log_path)
+
+        self.fetched = list()
+        self.extract_filters = dict()
+        self.staged_extractions = dict()
+        self.usage = list()
+
         # Call the parent's manifest instructions
         os.chdir(self.build_cache)
         return self.manifest.instructions(self)
@@ -1,11 +1,98 @@
 #!/usr/bin/env python3.6
 # -*- coding: utf-8 -*-
-"""Provides a way to execute shell commands."""
+"""Provides a way to execute shell commands.
+
+Commands are executed one after the other by :py:func:`.cmd`. Independent commands can also be executed at the same time with
+:py:func:`.cmd_async`, and waited for with :py:func:`.gather`::
+
+    docs = stdlib.cmd_async('make doc')
+    tests = stdlib.cmd_async('make check', cwd='tests', env={'VERBOSE': '1'})
+    stdlib.gather(docs, tests)
+"""
 
 import os
+import sys
+import time
+import gzip
+import select
+import shutil
+import tempfile
+import threading
+import collections
+import contextlib
+import concurrent.futures
 import core
+import core.config
 import stdlib.log
+import stdlib.build
+import stdlib.shell
+import stdlib.usage
 import subprocess
+from multiprocessing import cpu_count
+from typing import Dict, List
+
+# Lines longer than this are split, so a command writing no newline (like a progress bar) can't use an unbounded amount of memory
+_MAX_LINE_LENGTH = 64 * 1024
+
+# The log files favor speed over size, as they are written while the build is running
+_LOG_COMPRESS_LEVEL = 1
+
+_executor = None
+_log_lock = threading.Lock()
+
+
+class CommandError(Exception):
+    """The error of a command executed by :py:func:`.cmd_async` that returned a value different than ``0`` while ``fail_ok`` wasn't ``True``.
+
+    :ivar cmd: The shell command.
+    :vartype cmd: ``str``
+
+    :ivar code: The exit code of the command.
+    :vartype code: ``int``
+
+    :ivar cwd: The working directory of the command.
+    :vartype cwd: ``str``
+
+    :ivar env: The environment of the command.
+    :vartype env: ``Dict`` [ ``str``, ``str`` ]
+
+    :ivar tail: The last lines of the output of the command.
+    :vartype tail: ``List`` [ ``bytes`` ]
+    """
+    def __init__(
+        self,
+        cmd: str,
+        code: int,
+        cwd: str,
+        env: Dict[str, str],
+        tail: List[bytes],
+    ):
+        super().__init__(f"Command exited with non-zero code {code}: {cmd}")
+        self.cmd = cmd
+        self.code = code
+        self.cwd = cwd
+        self.env = env
+        self.tail = tail
+
+
+class CommandFuture(concurrent.futures.Future):
+    """The future exit code of a command executed by :py:func:`.cmd_async`.
+
+    If the command fails and ``fail_ok`` wasn't ``True``, the future holds a :py:class:`.CommandError` instead.
+
+    :ivar cmd: The shell command.
+    :vartype cmd: ``str``
+
+    :ivar log_lines: The logs printed while executing the command, held back until they are printed by :py:func:`.gather`.
+    :vartype log_lines: ``List`` [ ``str`` ]
+    """
+    def __init__(
+        self,
+        cmd: str,
+    ):
+        super().__init__()
+        self.cmd = cmd
+        self.log_lines = list()
 
 
 def cmd(
@@ -16,31 +103,305 @@ def cmd(
 
     If the command fails and ``fail_ok`` is not ``True``, the execution of the build manifest is aborted.
 
-    :note: :py:func:`.cmd` doesn **not** return until the command finishes.
+    The output of the command (both its standard output and its standard error) is appended to the log file of the current build
+    (see :py:func:`~core.cache.get_log_path`), compressed with ``gzip``. Its last lines are also kept in memory, and printed if the
+    command fails. The number of lines kept is the value of ``tail_lines`` in the ``[log]`` section of the configuration file,
+    or ``50`` if there is none. With ``-vv``, the output is printed as it is produced instead, its standard output and standard error
+    going to the ones of ``nbuild``.
+
+    :py:func:`.cmd` returns once ``bash`` exits, even if processes the command started in the background still run. They can't write
+    to its output after that (they get ``SIGPIPE``), so their output should be redirected to a file.
+
+    The resources used by the command are recorded in the current build (see :py:mod:`stdlib.usage`).
+
+    The command is executed by a new ``bash`` process, or by the persistent shell of the build if it is enabled in the configuration
+    file (see :py:mod:`stdlib.shell`).
+
+    :note: :py:func:`.cmd` doesn **not** return until the command finishes. See :py:func:`.cmd_async` to execute it in the background.
 
     :param cmd: The shell command to execute.
     :param fail_ok: Indicate whether or not to abort if the command returns a value different than ``0``.
+    :returns: The exit code of the command.
+    """
+    (code, tail) = _run(cmd)
+
+    if code != 0 and not fail_ok:
+        _log_failure(cmd, code, os.getcwd(), os.environ, tail)
+        exit(1)
+
+    return code
+
+
+def cmd_async(
+    cmd: str,
+    fail_ok: bool = False,
+    cwd: str = '.',
+    env: Dict[str, str] = None,
+) -> CommandFuture:
+    """Execute a shell command in the background, and return right away.
+
+    The command is executed by a pool of threads, in the working directory and with the environment it was given when
+    :py:func:`.cmd_async` was called: changing them afterwards (with :py:func:`~stdlib.pushd.pushd` or
+    :py:func:`~stdlib.pushenv.pushenv` for example) has no effect on the command. The number of threads is the value of ``async_jobs``
+    in the ``[shell]`` section of the configuration file, or the number of CPUs (at least ``4``) if there is none.
+
+    Its output is handled like the one of :py:func:`.cmd`, and its logs are held back until :py:func:`.gather` prints them.
+
+    :param cmd: The shell command to execute.
+    :param fail_ok: Indicate whether or not to abort if the command returns a value different than ``0``. The execution of the build
+        manifest is aborted by :py:func:`.gather`.
+    :param cwd: The working directory of the command, relative to the current one. The default value is the current one.
+    :param env: Variables added to (or replaced in) the current environment for the command. The default value is ``None``.
+    :returns: The future exit code of the command.
+    """
+    global _executor
+
+    if _executor is None:
+        # The threads only wait for their command, which can run its own jobs (like `make -j`), so the pool isn't sized after the CPUs
+        jobs = (core.config.get_config() or {}).get('shell', {}).get('async_jobs', max(4, cpu_count()))
+        _executor = concurrent.futures.ThreadPoolExecutor(jobs)
+
+    task_env = dict(os.environ)
+    task_env.update(env or {})
+
+    future = CommandFuture(cmd)
+    _executor.submit(_run_async, future, fail_ok, os.path.abspath(cwd), task_env, stdlib.usage.current_step(), stdlib.log.get_log_level())
+    return future
+
+
+def gather(
+    *futures: CommandFuture,
+) -> List[int]:
+    """Wait for the commands executed by :py:func:`.cmd_async` to finish, and print their logs, in the given order.
+
+    If a command fails and its ``fail_ok`` wasn't ``True``, the commands that haven't started yet are cancelled, the ones already
+    running are waited for, and the execution of the build manifest is aborted.
+
+    :param futures: The futures returned by :py:func:`.cmd_async`.
+    :returns: The exit codes of the commands, in the given order.
+    """
+    (done, not_done) = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_EXCEPTION)
+    if any(not future.cancelled() and future.exception() is not None for future in done):
+        for future in not_done:
+            future.cancel()
+        concurrent.futures.wait(futures)
+
+    codes = list()
+    failed = False
+    for future in futures:
+        stdlib.log.flushlog(future.log_lines)
+        future.log_lines.clear()
+
+        if future.cancelled():
+            stdlib.log.wlog(f"Cancelled: {future.cmd}")
+            continue
+
+        error = future.exception()
+        if isinstance(error, CommandError):
+            _log_failure(error.cmd, error.code, error.cwd, error.env, error.tail)
+            failed = True
+        elif error is not None:
+            raise error
+        else:
+            codes.append(future.result())
+
+    if failed:
+        exit(1)
+
+    return codes
+
+
+def _run_async(future, fail_ok, cwd, env, step, log_level):
+    if not future.set_running_or_notify_cancel():
+        return
+
+    try:
+        with stdlib.log.bufferlog(future.log_lines), stdlib.log.indentlog(log_level), stdlib.usage.step(step):
+            (code, tail) = _run(future.cmd, cwd, env, private_log=True)
+
+        if code != 0 and not fail_ok:
+            future.set_exception(CommandError(future.cmd, code, cwd, env, tail))
+        else:
+            future.set_result(code)
+    except BaseException as e:
+        future.set_exception(e)
+
+
+def _run(cmd, cwd=None, env=None, private_log=False):
+    """Execute ``cmd`` in ``cwd`` with ``env`` (the ones of this process if ``None``), and return its exit code and the last lines of
+    its output.
+
+    If ``private_log`` is ``True``, the output is written to a temporary file first, and appended to the log file of the build once the
+    command finishes, so commands running at the same time don't mix their output.
     """
 
     if core.args.get_args().verbose >= 1:
         stdlib.log.dlog(cmd)
 
-    if core.args.get_args().verbose < 2:
-        code = subprocess.run(
-            ['bash', '-e', '-c', cmd],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-        ).returncode
-    else:
-        code = subprocess.run(['bash', '-e', '-c', cmd]).returncode
+    build = stdlib.build.current_build()
+    log_path = build.log_path if build is not None else None
+    tail = collections.deque(maxlen=(core.config.get_config() or {}).get('log', {}).get('tail_lines', 50))
 
-    if code != 0 and not fail_ok:
-        stdlib.log.flog(f"Command exited with non-zero code {code}:")
-        stdlib.log.dlog(f"Command: \"{cmd}\"")
-        stdlib.log.dlog(f"Working directory: {os.getcwd()}")
-        stdlib.log.dlog(f"Environment:")
-        with stdlib.log.pushlog():
-            for key, value in os.environ.items():
-                stdlib.log.dlog(f'{key}={value}')
+    with contextlib.ExitStack() as stack:
+        log_file = None
+        if log_path is not None:
+            if private_log:
+                (fd, part_path) = tempfile.mkstemp(dir=os.path.dirname(log_path), prefix='.cmd-')
+                os.close(fd)
+                stack.callback(_append_log, part_path, log_path)
+                log_file = stack.enter_context(gzip.open(part_path, 'wb', compresslevel=_LOG_COMPRESS_LEVEL))
+            else:
+                stack.enter_context(_log_lock)
+                log_file = stack.enter_context(gzip.open(log_path, 'ab', compresslevel=_LOG_COMPRESS_LEVEL))
+            log_file.write(f'$ {cmd}\n'.encode())
 
-        exit(1)
+        # Commands executed in the background have their own working directory and environment, so they can't use the persistent shell
+        shell = stdlib.shell.get_shell() if cwd is None and env is None else None
+
+        last_line = b'\n'
+
+        def output(line, console):
+            nonlocal last_line
+            last_line = line
+            tail.append(line)
+            if log_file is not None:
+                log_file.write(line)
+            if core.args.get_args().verbose >= 2:
+                console.write(line)
+                console.flush()
+
+        start = time.monotonic()
+        if shell is not None:
+            (stdout_fd, stderr_fd) = shell.send(cmd)
+            _read_output({stdout_fd: sys.stdout.buffer, stderr_fd: sys.stderr.buffer}, shell.fileno(), output)
+        else:
+            process = stack.enter_context(subprocess.Popen(
+                ['bash', '-e', '-c', cmd],
+                cwd=cwd,
+                env=env,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            ))
+            (status, rusage) = _communicate(process, output)
+
+        # Keep the header of the next command on its own line
+        if log_file is not None and not last_line.endswith(b'\n'):
+            log_file.write(b'\n')
+
+        if shell is not None:
+            (code, usage) = shell.wait()
+            usage.wall_time = time.monotonic() - start
+            if code != 0:
+                stdlib.shell.restart_shell()
+        else:
+            usage = stdlib.usage.Usage.from_rusage(rusage, time.monotonic() - start)
+            code = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+            process.returncode = code
+
+    stdlib.usage.record(cmd, usage)
+    if core.args.get_args().verbose >= 1:
+        stdlib.log.dlog(f"Used {usage}")
+
+    return (code, list(tail))
+
+
+def _communicate(process, output):
+    """Pass the output of ``process`` to ``output`` line by line, with the console it goes to (``sys.stdout.buffer`` or
+    ``sys.stderr.buffer``), until ``process`` exits.
+
+    ``process`` is waited for by another thread, instead of reading its output until its end, as processes it started in the
+    background may keep its standard output open. Once it exited, what is left in the pipes is read without waiting for more.
+
+    :returns: The status of ``process`` and the resources it used, as returned by ``os.wait4()``.
+    """
+    (wake_fd, notify_fd) = os.pipe()
+    result = list()
+
+    def wait():
+        # Unlike Popen.wait(), wait4() also returns the resources used by the command and all the processes it waited for
+        result.extend(os.wait4(process.pid, 0)[1:])
+        os.write(notify_fd, b'\0')
+
+    waiter = threading.Thread(target=wait)
+    waiter.start()
+
+    try:
+        _read_output({process.stdout.fileno(): sys.stdout.buffer, process.stderr.fileno(): sys.stderr.buffer}, wake_fd, output)
+    finally:
+        waiter.join()
+        os.close(wake_fd)
+        os.close(notify_fd)
+
+    return tuple(result)
+
+
+def _read_output(consoles, wake_fd, output):
+    """Pass what is written to the file descriptors of ``consoles`` to ``output`` line by line, with the console each of them goes to,
+    until ``wake_fd`` is readable. What is left in them is then read without waiting for more.
+    """
+    pending = {fd: b'' for fd in consoles}
+    exited = False
+    while len(pending) > 0:
+        fds = list(pending) if exited else [*pending, wake_fd]
+        (ready, _, _) = select.select(fds, [], [], 0 if exited else None)
+        if exited and len(ready) == 0:
+            break
+
+        for fd in ready:
+            if fd == wake_fd:
+                exited = True
+                continue
+
+            data = os.read(fd, _MAX_LINE_LENGTH)
+            if len(data) == 0:
+                if len(pending[fd]) > 0:
+                    output(pending[fd], consoles[fd])
+                del pending[fd]
+            else:
+                pending[fd] = _split_lines(pending[fd] + data, lambda line: output(line, consoles[fd]))
+
+    for (fd, data) in pending.items():
+        if len(data) > 0:
+            output(data, consoles[fd])
+
+
+def _split_lines(data, output):
+    """Pass the complete lines of ``data`` to ``output``, splitting the ones longer than ``_MAX_LINE_LENGTH``, and return the rest."""
+    while True:
+        end = data.find(b'\n', 0, _MAX_LINE_LENGTH)
+        if end == -1:
+            if len(data) < _MAX_LINE_LENGTH:
+                return data
+            end = _MAX_LINE_LENGTH - 1
+        output(data[:end + 1])
+        data = data[end + 1:]
+
+
+def _append_log(part_path, log_path):
+    """Append the log file pointed to by ``part_path`` to the one pointed to by ``log_path``, and remove it.
+
+    :info: This works because a sequence of ``gzip`` members is a valid ``gzip`` file.
+    """
+    with _log_lock:
+        with open(part_path, 'rb') as part, open(log_path, 'ab') as log:
+            shutil.copyfileobj(part, log)
+    os.remove(part_path)
+
+
+def _log_failure(cmd, code, cwd, env, tail):
+    build = stdlib.build.current_build()
+    log_path = build.log_path if build is not None else None
+
+    stdlib.log.flog(f"Command exited with non-zero code {code}:")
+    stdlib.log.dlog(f"Command: \"{cmd}\"")
+    stdlib.log.dlog(f"Working directory: {cwd}")
+    stdlib.log.dlog(f"Environment:")
+    with stdlib.log.pushlog():
+        for key, value in env.items():
+            stdlib.log.dlog(f'{key}={value}')
+
+    if core.args.get_args().verbose < 2 and len(tail) > 0:
+        stdlib.log.dlog(f"Last {len(tail)} line(s) of output{f' (full output in {log_path})' if log_path else ''}:")
+        with stdlib.log.pushlog():
+            for line in tail:
+                stdlib.log.dlog(line.decode(errors='replace').rstrip('\r\n'))
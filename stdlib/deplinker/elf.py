@@ -2,12 +2,17 @@
 # -*- coding: utf-8 -*-
 """A primary dependency linker that assign requirements based on ELF dependencies."""
 
-import requests
+import os
 import ntpath
 import glob
+import toml
+import tarfile
+import functools
 import braceexpand
 import urllib.parse
+import urllib.request
 import core.config
+import core.network
 import stdlib
 import stdlib.log
 from typing import Optional
@@ -68,6 +73,9 @@ def elf_deplinker(
         directory structures. Default value is ``True``.
     :param local_resolving: Indicate whether or not other packages for ``packages`` should be used to solve dependencies. Default value is ``True``.
     :param remote_resolving: Indicate whether or not remote repositories should be used to solve dependencies. Default value is ``True``.
+        Repositories whose URL is a local path or a ``file://`` URL are directories of ``.nest`` files (like the output directory of
+        ``nbuild``), searched without using the network. The other repositories can't be used with ``--offline``: the build is aborted
+        if a dependency can't be solved without them, instead of producing packages without it.
     """
     binaries = dict()  # Key = a binary filename, Value = a package ID
     dependencies = dict()  # Key = a package ID, Value = a list of ELF filenames
@@ -152,6 +160,7 @@ def _solve_remotely(dependency) -> Optional[str]:
         return None
 
     solver_shortname = None
+    skipped = list()
 
     # Try all repositories from top to bottom
     #
@@ -160,47 +169,114 @@ def _solve_remotely(dependency) -> Optional[str]:
     for repository in config['repositories']:
         try:
             url = core.config.get_config()['repositories'][repository]['url']
-            r = requests.get(
-                url=f'{url}/api/search?q={urllib.parse.quote(dependency)}&search_by=content&exact_match=true',
-            )
+            local_path = _get_local_path(url)
 
-            if r.status_code == 200:
+            if local_path is not None:
+                results = _search_local_repository(repository, local_path, dependency)
+            elif core.network.is_offline():
+                skipped.append(repository)
+                continue
+            else:
+                r = core.network.get_session().get(
+                    url=f'{url}/api/search?q={urllib.parse.quote(dependency)}&search_by=content&exact_match=true',
+                    timeout=core.network.get_timeout(),
+                )
+
+                if r.status_code == 404:
+                    stdlib.log.elog(f"\"{repository}\" doesn't contain a package with file \"{dependency}\"")
+                    continue
+                elif r.status_code != 200:
+                    raise RuntimeError(f"Repository returned an unknown status code: {r.status_code}")
                 results = r.json()
 
-                if len(results) == 1:
-                    result = results[0]
-                    if not result['all_versions']:
-                        stdlib.log.elog(f"\"{repository}\" contains a single package with file \"{dependency}\" but not for all versions")
-                    else:
-                        short_name = result['name'].split('::')[1]
-                        if solver_shortname is not None and solver_shortname != short_name:
-                            stdlib.log.elog(
-                                f"Inconsistencies found. Both packages {solver_shortname} and {short_name} contain the file \"{dependency}\"" +
-                                "accross multiple repositories"
-                            )
-                            return None
-                        elif solver_shortname is None:
-                            solver_shortname = short_name
-
-                elif len(results) > 1:
-                    stdlib.log.elog(f"\"{repository}\" contains more than one package with file \"{dependency}\"")
+            if len(results) == 1:
+                result = results[0]
+                if not result['all_versions']:
+                    stdlib.log.elog(f"\"{repository}\" contains a single package with file \"{dependency}\" but not for all versions")
                 else:
-                    stdlib.log.elog(f"\"{repository}\" doesn't contain any package with file \"{dependency}\"")
-
-            elif r.status_code == 404:
-                stdlib.log.elog(f"\"{repository}\" doesn't contain a package with file \"{dependency}\"")
+                    short_name = result['name'].split('::')[1]
+                    if solver_shortname is not None and solver_shortname != short_name:
+                        stdlib.log.elog(
+                            f"Inconsistencies found. Both packages {solver_shortname} and {short_name} contain the file \"{dependency}\"" +
+                            "accross multiple repositories"
+                        )
+                        return None
+                    elif solver_shortname is None:
+                        solver_shortname = short_name
+
+            elif len(results) > 1:
+                stdlib.log.elog(f"\"{repository}\" contains more than one package with file \"{dependency}\"")
             else:
-                raise RuntimeError(f"Repository returned an unknown status code: {r.status_code}")
+                stdlib.log.elog(f"\"{repository}\" doesn't contain any package with file \"{dependency}\"")
         except Exception as e:
             stdlib.log.elog(f"An unknown error occurred when fetching \"{repository}\" (is the link dead?), skipping...")
             print(e)
 
+    # Producing the packages without the dependency would go unnoticed
+    if solver_shortname is None and len(skipped) > 0:
+        stdlib.log.flog(f"\"{dependency}\" can't be solved without {', '.join(skipped)}, which can't be used with --offline -- Aborting")
+        exit(1)
+
     if solver_shortname is not None:
         stdlib.log.slog(f"A single package \"{solver_shortname}\" was found with the file \"{dependency}\"!")
 
     return solver_shortname
 
 
+def _get_local_path(url) -> Optional[str]:
+    """Return the path of the repository pointed to by ``url`` if it is a local path or a ``file://`` URL, ``None`` otherwise."""
+    url_object = urllib.parse.urlparse(url)
+
+    if url_object.scheme == 'file':
+        return urllib.request.url2pathname(url_object.path)
+    elif url_object.scheme == '':
+        return url
+    return None
+
+
+def _search_local_repository(repository, path, dependency):
+    """Search the packages of the local repository ``path`` containing a file named ``dependency``.
+
+    :returns: The packages found, in the same format as the search API of a remote repository.
+    """
+    (files, versions) = _index_local_repository(path)
+
+    return [
+        {'name': f'{repository}::{short_name}', 'all_versions': file_versions == versions[short_name]}
+        for (short_name, file_versions) in sorted(files.get(dependency, {}).items())
+    ]
+
+
+@functools.lru_cache(maxsize=None)
+def _index_local_repository(path):
+    """Read the ``.nest`` files of the local repository ``path`` once, and index their files by name.
+
+    :returns: A tuple made of a dictionary with file names as keys and, as values, dictionaries with the short names of the packages
+        containing them as keys and the sets of versions of these packages containing them as values; and a dictionary with the short
+        names of the packages as keys and the sets of their versions as values.
+    """
+    files = dict()
+    versions = dict()
+
+    for nest_path in glob.glob(os.path.join(path, '**', '*.nest'), recursive=True):
+        try:
+            with tarfile.open(nest_path) as nest:
+                members = {os.path.normpath(member.name): member for member in nest.getmembers()}
+                manifest = toml.loads(nest.extractfile(members['manifest.toml']).read().decode())
+                short_name = f"{manifest['category']}/{manifest['name']}"
+                versions.setdefault(short_name, set()).add(manifest['version'])
+
+                if 'data.tar.gz' in members:
+                    with tarfile.open(fileobj=nest.extractfile(members['data.tar.gz'])) as data:
+                        for member in data:
+                            if not member.isdir():
+                                files.setdefault(ntpath.basename(member.name), {}).setdefault(short_name, set()).add(manifest['version'])
+        except (OSError, KeyError, tarfile.TarError, toml.TomlDecodeError) as e:
+            stdlib.log.wlog(f"Skipping {nest_path}, which isn't a valid package: {e}")
+
+    return (files, versions)
+
+
 def _fetch_elf_dependencies(package, elf_path) -> [str]:
     deps = []
 
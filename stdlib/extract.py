@@ -1,74 +1,752 @@
 #!/usr/bin/env python3.6
 # -*- coding: utf-8 -*-
-"""Provides functions to extract and manipulate tarballs."""
+"""Provides functions to extract and manipulate tarballs.
+
+Tarballs are recognized by their first bytes (their magic number), or by their extension when these aren't known, using a registry
+of :py:class:`.Codec`. When available, the decompression is done by an external, usually multi-threaded, program (like ``pigz`` or
+``xz -T0``) whose output is streamed to :py:mod:`tarfile`. Otherwise, :py:mod:`tarfile` decompresses the tarball itself.
+
+Zip archives are supported too: they are converted on the fly to a tarball stream, so they are extracted the same way.
+
+New formats can be supported with :py:func:`.register_codec`.
+
+All the extract functions can skip some members of the tarballs, using ``include`` and ``exclude``, two lists of patterns in the
+format of :py:mod:`fnmatch` (so ``*`` also matches ``/``). A member is extracted if it, or one of the directories containing it,
+matches one of the patterns of ``include`` (or if ``include`` is ``None``), and if none of them matches any of the patterns of
+``exclude``. The patterns are matched against the path the member is extracted to, relative to the current directory.
+Skipped members are never written, so this saves a lot of disk I/O when only a small part of a huge tarball is needed.
+
+Hard links to skipped members are skipped too.
+"""
 
 import os
 import tarfile
+import tempfile
+import zipfile
+import threading
+import time
+import stat
 import stdlib
 import shutil
-import itertools
+import fnmatch
+import subprocess
+import contextlib
+import core.args
 from glob import glob
-from braceexpand import braceexpand
+from typing import List, Optional
+from multiprocessing import cpu_count
+from concurrent.futures import ProcessPoolExecutor
+
+_STREAM_BUFFER_SIZE = 1024 * 1024
+
+_codecs = []
+
+
+class Codec():
+    """A compression format tarballs can be compressed with.
+
+    :param name: The name of the compression format.
+    :param extensions: The extensions of the tarballs compressed with this format, like ``.tar.gz``.
+    :param commands: A list of commands decompressing the file given as last argument to the standard output, in order of preference.
+        The first one whose program is installed is used. Each command is a list of arguments.
+    :param tarfile_mode: The mode used to open the tarballs with :py:mod:`tarfile` when none of ``commands`` is installed,
+        like ``r|gz``, or ``None`` if :py:mod:`tarfile` doesn't support this format.
+    :param magic: A list of byte strings starting the files compressed with this format, used to recognize them regardless of their
+        extension. The default value is ``[]``.
+    :param magic_offset: The offset, in bytes, where ``magic`` is found in the files. The default value is ``0``.
+    :param to_tar: For archives that aren't tarballs, a function writing the content of the archive pointed to by its first argument
+        as a tarball to the file object given as second argument. It is used instead of ``commands`` and ``tarfile_mode``.
+        The default value is ``None``.
+
+    :ivar name: The name of the compression format.
+    :vartype name: ``str``
+
+    :ivar extensions: The extensions of the tarballs compressed with this format.
+    :vartype extensions: ``List`` [ ``str`` ]
+
+    :ivar commands: A list of commands decompressing the file given as last argument to the standard output, in order of preference.
+    :vartype commands: ``List`` [ ``List`` [ ``str`` ] ]
+
+    :ivar tarfile_mode: The mode used to open the tarballs with :py:mod:`tarfile` when none of ``commands`` is installed.
+    :vartype tarfile_mode: ``str``
+
+    :ivar magic: A list of byte strings starting the files compressed with this format.
+    :vartype magic: ``List`` [ ``bytes`` ]
+
+    :ivar magic_offset: The offset, in bytes, where ``magic`` is found in the files.
+    :vartype magic_offset: ``int``
+
+    :ivar to_tar: For archives that aren't tarballs, a function writing their content as a tarball to a file object.
+    :vartype to_tar: fn (``str``, ``BinaryIO``) -> ``None``
+    """
+    def __init__(
+        self,
+        name: str,
+        extensions: List[str],
+        commands: List[List[str]] = [],
+        tarfile_mode: str = None,
+        magic: List[bytes] = [],
+        magic_offset: int = 0,
+        to_tar=None,
+    ):
+        self.name = name
+        self.extensions = extensions
+        self.commands = commands
+        self.tarfile_mode = tarfile_mode
+        self.magic = magic
+        self.magic_offset = magic_offset
+        self.to_tar = to_tar
+
+    def command(self) -> Optional[List[str]]:
+        """Return the first command of ``commands`` whose program is installed, or ``None`` if there is none."""
+        for command in self.commands:
+            if shutil.which(command[0]) is not None:
+                return command
+        return None
+
+
+def register_codec(
+    codec: Codec,
+):
+    """Add ``codec`` to the list of compression formats supported by the functions of this module.
+
+    :info: A codec registered later takes precedence over the ones registered before it for the magic numbers and the extensions
+        they have in common.
+
+    :param codec: The codec to register.
+    """
+    _codecs.insert(0, codec)
+
+
+def get_codec(
+    path: str,
+) -> Optional[Codec]:
+    """Return the codec of the tarball pointed to by ``path``, according to its magic number, or to its extension if its magic
+    number isn't known.
+
+    :param path: The path pointing to the tarball.
+    :returns: The codec of the tarball, or ``None`` if neither its magic number nor its extension is known.
+    """
+    with open(path, 'rb') as file:
+        header = file.read(tarfile.BLOCKSIZE)
+
+    return _get_codec_by_magic(header) or _get_codec_by_extension(path)
 
 
 def extract(
     path: str,
+    include: List[str] = None,
+    exclude: List[str] = None,
 ):
     """Extract the tarball pointed by ``path`` in the current directory.
 
     :param path: The path pointing to the tarball. It must be relative to the current directory.
+    :param include: If not ``None``, only the members matching one of these patterns are extracted. The default value is ``None``.
+    :param exclude: If not ``None``, the members matching one of these patterns are skipped. The default value is ``None``.
     """
     stdlib.log.ilog(f"Extracting {os.path.basename(path)}")
-    with tarfile.open(path, mode='r') as tar:
-        tar.extractall()
+    _extract(path, include=include, exclude=exclude)
     stdlib.log.slog(f"Extracted in {os.getcwd()}")
 
 
-def extract_all():
-    """Extract all tarballs of the current directory in the current directory."""
-    for xtarball in braceexpand('*.{tar.{gz,xz,bz2},tgz}'):
-        for tarball in itertools.chain(glob(xtarball)):
-            extract(tarball)
+def extract_all(
+    jobs: int = None,
+    include: List[str] = None,
+    exclude: List[str] = None,
+):
+    """Extract all tarballs of the current directory in the current directory.
+
+    The tarballs are extracted concurrently by a pool of processes, each one in its own temporary directory. They are then moved
+    to the current directory one after another, in the same order as if they were extracted one after another. If a tarball contains
+    a file that was already extracted by another one, it is reported and the file is replaced.
+
+    :info: A file is considered to be a tarball if its extension is known by one of the registered :py:class:`.Codec`.
+    :info: A tarball already extracted while it was downloaded (see :py:func:`~stdlib.fetch.fetch_url`) is moved in place instead,
+        if it was extracted with the same options.
+
+    :param jobs: The maximum number of tarballs extracted at the same time. The default value is the number of CPUs.
+        A value of ``1`` extracts the tarballs one after another, in the current process.
+    :param include: If not ``None``, only the members matching one of these patterns are extracted. The default value is ``None``,
+        in which case the ``include`` value of the ``fetch`` entry the tarball comes from, if any, is used (see :py:func:`~stdlib.fetch.fetch_url`).
+    :param exclude: If not ``None``, the members matching one of these patterns are skipped. The default value is ``None``,
+        in which case the ``exclude`` value of the ``fetch`` entry the tarball comes from, if any, is used.
+    """
+    _extract_all(flat=False, jobs=jobs, include=include, exclude=exclude)
 
 
 def flat_extract(
     path: str,
+    include: List[str] = None,
+    exclude: List[str] = None,
 ):
     """Extract the tarball pointed by ``path`` in the current directory.
 
-    If the tarball recursively contains a single folder, the content of the folder is moved to the current directory
-    The folder, now empty, is removed.
+    If the tarball contains a single folder, the content of the folder is extracted directly in the current directory,
+    like ``tar --strip-components=1`` would do. The folder itself isn't created.
+
+    :info: The tarball is read only once: the name of each member is rewritten as it is extracted. If a member outside of the folder
+        is found, what has been extracted so far is moved back inside the folder, and the rest of the tarball is extracted as is.
+        This is done in a temporary directory, whose content is then moved to the current directory, so the files that were already
+        there are never moved. The files the tarball replaces are reported.
 
     :param path: The path pointing to the tarball. It must be relative to the current directory.
+    :param include: If not ``None``, only the members matching one of these patterns are extracted. The default value is ``None``.
+        The patterns are matched against the paths without the folder, if it is stripped.
+    :param exclude: If not ``None``, the members matching one of these patterns are skipped. The default value is ``None``.
     """
     stdlib.log.ilog(f"Extracting {os.path.basename(path)}")
+    _extract_staged(path, flat=True, include=include, exclude=exclude)
 
-    main_dir = None
 
-    with tarfile.open(path, mode='r') as tar:
+def flat_extract_all(
+    jobs: int = None,
+    include: List[str] = None,
+    exclude: List[str] = None,
+):
+    """Extract all tarballs of the current directory in the current directory.
+
+    If any tarball contains a single folder, the content of the folder is extracted directly in the current directory,
+    like :py:func:`.flat_extract` does.
+
+    The tarballs are extracted concurrently, like :py:func:`.extract_all` does.
+
+    :info: A file is considered to be a tarball if its extension is known by one of the registered :py:class:`.Codec`.
+
+    :param jobs: The maximum number of tarballs extracted at the same time. The default value is the number of CPUs.
+        A value of ``1`` extracts the tarballs one after another, in the current process.
+    :param include: The same as for :py:func:`.extract_all`.
+    :param exclude: The same as for :py:func:`.extract_all`.
+    """
+    _extract_all(flat=True, jobs=jobs, include=include, exclude=exclude)
+
+
+def extract_stream(
+    stream,
+    name: str,
+    dest: str,
+    flat: bool = False,
+    include: List[str] = None,
+    exclude: List[str] = None,
+):
+    """Extract the tarball read from ``stream`` in the directory ``dest``, while it is being read.
+
+    Unlike the other extract functions, it doesn't depend on the current directory, so it can be called from any thread.
+    It is used by :py:func:`~stdlib.fetch.fetch_url` to extract tarballs while they are being downloaded.
+
+    :note: ``stream`` is always read until its end if the extraction succeeds, even if the tarball ends before.
+    :note: Zip archives can't be extracted while being read, as their table of contents is at their end. A ``ValueError`` is raised.
+
+    :param stream: A file object the content of the tarball is read from, with a ``read()`` method returning ``b''`` at its end.
+    :param name: The name of the tarball, used to recognize its format if its magic number isn't known.
+    :param dest: The path pointing to the directory to extract the tarball in.
+    :param flat: Whether to strip the main directory of the tarball, like :py:func:`.flat_extract` does. The default value is ``False``.
+    :param include: The same as for :py:func:`.extract`.
+    :param exclude: The same as for :py:func:`.extract`.
+    """
+    header = b''
+    while len(header) < tarfile.BLOCKSIZE:
+        data = stream.read(tarfile.BLOCKSIZE - len(header))
+        if not data:
+            break
+        header += data
+
+    codec = _get_codec_by_magic(header) or _get_codec_by_extension(name)
+    command = codec.command() if codec is not None else None
+
+    if codec is None or codec.to_tar is not None or (command is None and codec.tarfile_mode is None):
+        raise ValueError(f"{name} can't be extracted while it is being read")
+
+    errors = list()
+
+    def feed(sink):
+        try:
+            with sink:
+                sink.write(header)
+                for data in iter(lambda: stream.read(_STREAM_BUFFER_SIZE), b''):
+                    sink.write(data)
+        except BrokenPipeError:
+            pass  # The extraction stopped early, and its own error is reported instead
+        except BaseException as e:
+            errors.append(e)
+
+    if command is None:
+        (read_fd, write_fd) = os.pipe()
+        feeder = threading.Thread(target=feed, args=(open(write_fd, 'wb'),))
+        feeder.start()
         try:
-            main_dir = os.path.commonpath(tar.getnames())
-        except:
-            pass
-        tar.extractall()
-
-    if main_dir is not None and os.path.exists(main_dir) and os.path.isdir(main_dir):
-        for f in os.listdir(main_dir):
-            shutil.move(
-                os.path.join(main_dir, f),
-                '.'
-            )
-        shutil.rmtree(main_dir)
+            with open(read_fd, 'rb') as source:
+                # The stream modes of tarfile are the same as the random access ones, with a `|` instead of a `:`
+                with tarfile.open(fileobj=source, mode=codec.tarfile_mode.replace(':', '|')) as tar:
+                    _extract_members(tar, dest, flat, include, exclude)
+
+                while source.read(tarfile.RECORDSIZE):
+                    pass
+        finally:
+            feeder.join()
+    else:
+        if core.args.get_args().verbose >= 1:
+            stdlib.log.dlog(f"Decompressing with {' '.join(command)}")
+
+        with subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE) as process:
+            feeder = threading.Thread(target=feed, args=(process.stdin,))
+            feeder.start()
+            try:
+                with tarfile.open(fileobj=process.stdout, mode='r|') as tar:
+                    _extract_members(tar, dest, flat, include, exclude)
+
+                while process.stdout.read(tarfile.RECORDSIZE):
+                    pass
+            except BaseException:
+                process.kill()
+                raise
+            finally:
+                feeder.join()
+
+        if process.returncode != 0:
+            stdlib.log.flog(f"Failed to decompress {name}: {command[0]} exited with status {process.returncode}")
+            exit(1)
+
+    if len(errors) > 0:
+        raise errors[0]
+
+
+def _extract_all(flat, jobs, include, exclude):
+    tarballs = _find_tarballs()
+
+    # The filters given to `fetch()` are used when there is none
+    build = stdlib.build.current_build()
+    extract_filters = build.extract_filters if build is not None else dict()
+    filters = [
+        (
+            include if include is not None else extract_filters.get(tarball, {}).get('include'),
+            exclude if exclude is not None else extract_filters.get(tarball, {}).get('exclude'),
+        )
+        for tarball in tarballs
+    ]
+
+    # Tarballs extracted while being downloaded are reused, if they were extracted the same way
+    staged_extractions = build.staged_extractions if build is not None else dict()
+    staged_dirs = [
+        _get_staged_extraction(staged_extractions.get(tarball), flat, *tarball_filters)
+        for (tarball, tarball_filters) in zip(tarballs, filters)
+    ]
+    jobs = min(jobs or cpu_count(), len([staged_dir for staged_dir in staged_dirs if staged_dir is None]))
+
+    if jobs <= 1:
+        for (tarball, (tarball_include, tarball_exclude), staged_dir) in zip(tarballs, filters, staged_dirs):
+            if staged_dir is not None:
+                stdlib.log.ilog(f"Extracting {os.path.basename(tarball)} (extracted while downloading it)")
+                _merge_staging_dir(tarball, staged_dir)
+            else:
+                stdlib.log.ilog(f"Extracting {os.path.basename(tarball)}")
+                _extract_staged(tarball, flat, tarball_include, tarball_exclude)
+        return
+
+    # The temporary directories are in the current one, so moving their content out of them is only a matter of renaming it
+    staging_dirs = [
+        tempfile.mkdtemp(prefix='.extract-', dir='.') if staged_dir is None else staged_dir
+        for staged_dir in staged_dirs
+    ]
+
+    try:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [
+                executor.submit(
+                    _extract_buffered,
+                    stdlib.log.get_log_level(),
+                    os.path.abspath(tarball),
+                    os.path.abspath(staging_dir),
+                    flat,
+                    *tarball_filters,
+                )
+                if staged_dir is None else None
+                for (tarball, staging_dir, staged_dir, tarball_filters) in zip(tarballs, staging_dirs, staged_dirs, filters)
+            ]
+
+            for (tarball, staging_dir, future) in zip(tarballs, staging_dirs, futures):
+                if future is None:
+                    stdlib.log.ilog(f"Extracting {os.path.basename(tarball)} (extracted while downloading it)")
+                    _merge_staging_dir(tarball, staging_dir)
+                    continue
+
+                stdlib.log.ilog(f"Extracting {os.path.basename(tarball)}")
+
+                lines, error = future.result()
+                stdlib.log.flushlog(lines)
+
+                if error is not None:
+                    for future in futures:
+                        if future is not None:
+                            future.cancel()
+                    raise error
+
+                _merge_staging_dir(tarball, staging_dir)
+    finally:
+        for staging_dir in staging_dirs:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+def _get_staged_extraction(staged_extraction, flat, include, exclude):
+    """Return the directory ``staged_extraction`` (see :py:attr:`.Build.staged_extractions`) was extracted in, if it was extracted
+    with the given options, or ``None``."""
+    if staged_extraction is None or not os.path.isdir(staged_extraction['path']):
+        return None
+    if (staged_extraction['flat'], staged_extraction['include'], staged_extraction['exclude']) != (flat, include, exclude):
+        return None
+    return staged_extraction['path']
+
+
+def _merge_staging_dir(tarball, staging_dir):
+    """Move the content of ``staging_dir``, where ``tarball`` was extracted, to the current directory, reporting the overwritten files."""
+    overwritten = list()
+    _merge_tree(staging_dir, '.', overwritten)
+
+    if len(overwritten) > 0:
+        stdlib.log.wlog(f"{os.path.basename(tarball)} overwrote {len(overwritten)} file(s) extracted before it:")
+        with stdlib.log.pushlog():
+            for path in overwritten:
+                stdlib.log.wlog(path)
 
     stdlib.log.slog(f"Extracted in {os.getcwd()}")
 
 
-def flat_extract_all():
-    """Extract all tarballs of the current directory in the current directory.
+def _extract_staged(path, flat, include, exclude):
+    """Extract the tarball pointed to by ``path`` in a temporary directory, then move its content to the current directory with
+    :py:func:`._merge_staging_dir`."""
+    # The temporary directory is in the current one, so moving its content out of it is only a matter of renaming it
+    staging_dir = tempfile.mkdtemp(prefix='.extract-', dir='.')
+    try:
+        tarball = os.path.abspath(path)
+        with stdlib.pushd(staging_dir):
+            _extract(tarball, flat, include, exclude)
+        _merge_staging_dir(path, staging_dir)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+def _extract_buffered(log_level, path, dest, flat, include, exclude):
+    """Extract the tarball pointed to by ``path`` in ``dest``, holding back the logs, indented by ``log_level``. This is run by the
+    processes of :py:func:`._extract_all`.
+
+    :returns: A tuple made of the lines logged and the exception raised, if any.
+    """
+    with stdlib.log.bufferlog() as lines, stdlib.log.indentlog(log_level):
+        try:
+            with stdlib.pushd(dest):
+                _extract(path, flat, include, exclude)
+        except BaseException as error:  # Also catch `exit()`, so it is forwarded to the calling process
+            return lines, error
+    return lines, None
 
-    If any tarball contains a single folder, the content of the folder is moved in the current directory
-    and the folder, now empty, is removed.
+
+def _merge_tree(src, dst, overwritten):
+    """Move the content of the directory ``src`` to the directory ``dst``, merging the directories they have in common.
+
+    The paths of ``dst`` that are replaced by those of ``src`` are appended to ``overwritten``.
     """
-    for xtarball in braceexpand('*.{tar.{gz,xz,bz2},tgz}'):
-        for tarball in itertools.chain(glob(xtarball)):
-            flat_extract(tarball)
+    for name in sorted(os.listdir(src)):
+        src_path = os.path.join(src, name)
+        dst_path = os.path.join(dst, name)
+
+        if os.path.isdir(src_path) and not os.path.islink(src_path) and os.path.isdir(dst_path) and not os.path.islink(dst_path):
+            _merge_tree(src_path, dst_path, overwritten)
+            continue
+
+        if os.path.lexists(dst_path):
+            overwritten.append(os.path.normpath(dst_path))
+            if os.path.isdir(dst_path) and not os.path.islink(dst_path):
+                shutil.rmtree(dst_path)
+            else:
+                os.remove(dst_path)
+        os.rename(src_path, dst_path)
+
+
+def _get_codec_by_magic(header):
+    for codec in _codecs:
+        if any(header.startswith(magic, codec.magic_offset) for magic in codec.magic):
+            return codec
+    return None
+
+
+def _get_codec_by_extension(path):
+    for codec in _codecs:
+        if any(path.endswith(extension) for extension in codec.extensions):
+            return codec
+    return None
+
+
+def _find_tarballs():
+    """Return the tarballs of the current directory, recognized by their extension, sorted by name.
+
+    Their format is detected later by :py:func:`.get_codec`, so a tarball whose extension doesn't match its format is extracted anyway.
+    """
+    tarballs = set()
+
+    for codec in _codecs:
+        for extension in codec.extensions:
+            tarballs.update(glob(f'*{extension}'))
+    return sorted(tarballs)
+
+
+def _extract(path, flat=False, include=None, exclude=None):
+    """Extract the tarball pointed to by ``path`` in the current directory, stripping its main directory if ``flat`` is ``True``."""
+    with _open_tarball(path) as tar:
+        _extract_members(tar, '.', flat, include, exclude)
+
+
+def _extract_members(tar, dest, flat, include, exclude):
+    members = _flat_members(tar, dest) if flat else _members(tar)
+
+    if include is not None or exclude is not None:
+        members = _filter_members(members, include, exclude)
+    tar.extractall(path=dest, members=members)
+
+
+@contextlib.contextmanager
+def _open_tarball(path):
+    """Open the tarball pointed to by ``path`` for reading, through the decompressor of its codec if it is installed.
+
+    :note: The tarball may only be readable as a stream, so its members must be read in order and only once.
+    """
+    codec = get_codec(path)
+    command = codec.command() if codec is not None else None
+
+    if codec is not None and codec.to_tar is not None:
+        with _open_converted(codec, path) as tar:
+            yield tar
+        return
+
+    if command is None:
+        if codec is not None and codec.tarfile_mode is None:
+            programs = ', '.join(command[0] for command in codec.commands)
+            stdlib.log.flog(f"None of the programs needed to decompress {os.path.basename(path)} is installed: {programs}")
+            exit(1)
+
+        with tarfile.open(path, mode=codec.tarfile_mode if codec is not None else 'r') as tar:
+            yield tar
+        return
+
+    if core.args.get_args().verbose >= 1:
+        stdlib.log.dlog(f"Decompressing with {' '.join(command)}")
+
+    with subprocess.Popen([*command, path], stdout=subprocess.PIPE) as process:
+        try:
+            with tarfile.open(fileobj=process.stdout, mode='r|') as tar:
+                yield tar
+
+            # Consume the padding after the end of the archive, so the decompressor doesn't fail writing it
+            while process.stdout.read(tarfile.RECORDSIZE):
+                pass
+        except BaseException:
+            process.kill()
+            raise
+
+    if process.returncode != 0:
+        stdlib.log.flog(f"Failed to decompress {os.path.basename(path)}: {command[0]} exited with status {process.returncode}")
+        exit(1)
+
+
+@contextlib.contextmanager
+def _open_converted(codec, path):
+    """Open the archive pointed to by ``path``, converted to a tarball stream by ``codec.to_tar`` in another thread."""
+    (read_fd, write_fd) = os.pipe()
+    errors = list()
+
+    def convert():
+        try:
+            with open(write_fd, 'wb') as stream:
+                codec.to_tar(path, stream)
+        except BaseException as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=convert)
+    thread.start()
+    try:
+        with open(read_fd, 'rb') as stream:
+            with tarfile.open(fileobj=stream, mode='r|') as tar:
+                yield tar
+
+            while stream.read(tarfile.RECORDSIZE):
+                pass
+    except tarfile.TarError:
+        # The stream is truncated when the conversion fails, so the error of the conversion is more helpful
+        thread.join()
+        if len(errors) == 0:
+            raise
+    finally:
+        # Closing the reading end of the pipe makes the conversion stop if the extraction failed
+        thread.join()
+
+    if len(errors) > 0:
+        stdlib.log.flog(f"Failed to read {os.path.basename(path)}: {errors[0]}")
+        exit(1)
+
+
+def _zip_to_tar(path, stream):
+    """Write the content of the zip archive pointed to by ``path`` as a tarball to ``stream``."""
+    with zipfile.ZipFile(path) as archive, tarfile.open(fileobj=stream, mode='w|', format=tarfile.PAX_FORMAT) as tar:
+        for info in archive.infolist():
+            member = tarfile.TarInfo(info.filename.rstrip('/'))
+            member.mtime = time.mktime(info.date_time + (0, 0, -1))
+            mode = info.external_attr >> 16  # Only set by archivers running on Unix
+
+            if info.filename.endswith('/'):
+                member.type = tarfile.DIRTYPE
+                member.mode = stat.S_IMODE(mode) or 0o755
+                tar.addfile(member)
+            elif stat.S_ISLNK(mode):
+                member.type = tarfile.SYMTYPE
+                member.linkname = archive.read(info).decode()
+                member.mode = 0o777
+                tar.addfile(member)
+            else:
+                member.size = info.file_size
+                member.mode = stat.S_IMODE(mode) or 0o644
+                with archive.open(info) as data:
+                    tar.addfile(member, data)
+
+
+def _members(tar):
+    for member in tar:
+        # Members are never looked up once extracted, so there is no need to keep all of them in memory
+        tar.members = []
+        yield member
+
+
+def _flat_members(tar, dest='.'):
+    """Yield the members of ``tar``, without the first component of their name if all of them are in the same directory.
+
+    The directory is the first component of the first member. If a member outside of it is found, the entries already extracted
+    in ``dest`` are moved back into it, and the remaining members are yielded as is.
+    """
+    main_dir = None
+    top_level = set()  # The names of the entries extracted in `dest` instead of `main_dir`
+    stripped_dirs = list()  # The directories whose name was stripped, whose attributes are set by `extractall()` at the end
+
+    for member in _members(tar):
+        name = os.path.normpath(member.name)
+        first, _, rest = name.partition('/')
+
+        if name == '.':
+            yield member
+            continue
+
+        if main_dir is None:
+            main_dir = first if rest or member.isdir() else ''
+
+        if main_dir and first == main_dir:
+            if not rest:
+                continue
+
+            member.name = rest
+            top_level.add(rest.partition('/')[0])
+
+            if member.isdir():
+                stripped_dirs.append(member)
+            elif member.islnk():
+                link_first, _, link_rest = os.path.normpath(member.linkname).partition('/')
+                if link_first == main_dir and link_rest:
+                    member.linkname = link_rest
+        elif main_dir:
+            if core.args.get_args().verbose >= 1:
+                stdlib.log.dlog(f"{member.name} is outside of {main_dir}, extracting as is")
+            _unflatten(dest, main_dir, top_level)
+
+            for stripped_dir in stripped_dirs:
+                stripped_dir.name = os.path.join(main_dir, stripped_dir.name)
+            main_dir = ''
+            stripped_dirs = list()
+
+        yield member
+
+
+def _filter_members(members, include, exclude):
+    """Yield the members of ``members`` matching the filters ``include`` and ``exclude`` (see :py:mod:`stdlib.extract`)."""
+    def is_included(name):
+        return _matches(name, include) if include is not None else True
+
+    def is_excluded(name):
+        return _matches(name, exclude) if exclude is not None else False
+
+    for member in members:
+        if is_included(member.name) and not is_excluded(member.name):
+            # A hard link can't be extracted without its target
+            if member.islnk() and (not is_included(member.linkname) or is_excluded(member.linkname)):
+                continue
+            yield member
+
+
+def _matches(name, patterns):
+    """Test whether ``name``, or one of the directories containing it, matches one of ``patterns``."""
+    name = os.path.normpath(name)
+
+    while name not in ['', '.', '/']:
+        if any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns):
+            return True
+        name = os.path.dirname(name)
+    return False
+
+
+def _unflatten(dest, main_dir, names):
+    """Move the entries of ``dest`` listed in ``names`` into a new directory of ``dest`` named ``main_dir``."""
+    tmp_dir = tempfile.mkdtemp(prefix=f'.{main_dir}.', dir=dest)
+
+    for name in names:
+        if os.path.lexists(os.path.join(dest, name)):
+            os.rename(os.path.join(dest, name), os.path.join(tmp_dir, name))
+    os.chmod(tmp_dir, 0o755)
+    os.rename(tmp_dir, os.path.join(dest, main_dir))
+
+
+register_codec(Codec(
+    name='gzip',
+    extensions=['.tar.gz', '.tgz'],
+    commands=[['pigz', '--decompress', '--stdout']],
+    tarfile_mode='r:gz',
+    magic=[b'\x1f\x8b'],
+))
+register_codec(Codec(
+    name='xz',
+    extensions=['.tar.xz', '.txz'],
+    commands=[['xz', '--decompress', '--stdout', '--threads=0']],
+    tarfile_mode='r:xz',
+    magic=[b'\xfd7zXZ\x00'],
+))
+register_codec(Codec(
+    name='bzip2',
+    extensions=['.tar.bz2', '.tbz2'],
+    commands=[['pbzip2', '--decompress', '--stdout'], ['lbzip2', '--decompress', '--stdout']],
+    tarfile_mode='r:bz2',
+    magic=[b'BZh'],
+))
+register_codec(Codec(
+    name='zstd',
+    extensions=['.tar.zst', '.tzst'],
+    commands=[['zstd', '--decompress', '--stdout', '--threads=0']],
+    magic=[b'\x28\xb5\x2f\xfd'],
+))
+register_codec(Codec(
+    name='lz4',
+    extensions=['.tar.lz4'],
+    commands=[['lz4', '--decompress', '--stdout']],
+    magic=[b'\x04\x22\x4d\x18'],
+))
+register_codec(Codec(
+    name='lzip',
+    extensions=['.tar.lz', '.tlz'],
+    commands=[['plzip', '--decompress', '--stdout'], ['lzip', '--decompress', '--stdout']],
+    magic=[b'LZIP'],
+))
+register_codec(Codec(
+    name='tar',
+    extensions=['.tar'],
+    tarfile_mode='r:',
+    magic=[b'ustar'],
+    magic_offset=257,
+))
+register_codec(Codec(
+    name='zip',
+    extensions=['.zip'],
+    magic=[b'PK\x03\x04', b'PK\x05\x06'],
+    to_tar=_zip_to_tar,
+))
@@ -8,10 +8,41 @@ import shutil
 import hashlib
 import requests
 import ftplib
+import time
+import threading
+import toml
+import shlex
+import tarfile
+import subprocess
+import contextlib
+import socket
+import math
+import collections
+import core.args
+import core.clone
+import core.config
+import core.network
+import stdlib.extract
+from core.cache import get_content_path, get_git_cache, get_extract_cache
+from typing import List, Union
 from urllib.parse import urlparse
+from urllib.request import pathname2url, url2pathname
+from concurrent.futures import ThreadPoolExecutor
 
+_HASH_BUFFER_SIZE = 1024 * 1024
 
-def fetch():
+# Downloaded data is written as soon as this much is received, so little is lost when the connection drops
+_READ_BUFFER_SIZE = 64 * 1024
+_FTP_BLOCK_SIZE = 256 * 1024
+
+# The delay, in seconds, before reading a file being downloaded again once all its content so far was read
+_FOLLOW_DELAY = 0.05
+
+
+def fetch(
+    jobs: int = None,
+    jobs_per_host: int = None,
+):
     """Fetch the input data contained in the versionized argument ``fetch``.
 
     The versionized argument ``fetch`` must be an array of dictionaries. Each entry in the array is a data to fetch.
@@ -25,6 +56,13 @@ def fetch():
 
     If the dictionary contains multiple valid keys, a ``ValueError`` is raised.
 
+    Files may also be looked up in a local mirror, a directory given by ``local_mirror`` in the ``[fetch]`` section of the configuration file
+    (as a path or a ``file://`` URL). It holds files under the name they are downloaded with, and git repositories under the last component
+    of their URL (like ``linux.git``). The local mirror is always tried before the network.
+
+    When ``--offline`` is given on the command line, only the caches and the local mirror are used. If any entry isn't available there,
+    the complete list of missing entries is printed and the build is aborted before anything is fetched.
+
     *Example:* ::
 
         'fetch': [{
@@ -53,21 +91,219 @@ def fetch():
 
         fetch_file(file='./hello_world')
 
+    The entries handled by :py:func:`.fetch_url` are downloaded concurrently in the download cache by a pool of at most ``jobs`` threads,
+    with at most ``jobs_per_host`` of them talking to the same host at the same time. Everything else, including copying the downloaded
+    files to the build cache, is done one entry after another by the calling thread. An entry given twice is only downloaded once,
+    and the build is aborted if two different entries would be downloaded in files with the same name.
+
+    :note: The logs of each entry are held back and printed in the order of the entries, as if they were fetched one after another.
+
+    :param jobs: The maximum number of concurrent downloads. The default value is the value of ``jobs`` in the ``[fetch]`` section
+        of the configuration file, or ``4`` if there is none. A value of ``1`` downloads the entries one after another.
+    :param jobs_per_host: The maximum number of concurrent downloads from the same host. The default value is the value of
+        ``jobs_per_host`` in the ``[fetch]`` section of the configuration file, or ``2`` if there is none.
     """
     build = stdlib.build.current_build()
 
     inputs = build.args.get('fetch', [])
 
     for input in inputs:
-        if ('url' in input) + ('file' in input) + ('git' in input) == 1:
+        if ('url' in input) + ('file' in input) + ('git' in input) != 1:
+            raise ValueError("A single entry of data given to fetch() contains either no `url` or `file` key, or a mixture of them.")
+
+    _check_install_paths(build, inputs)
+
+    if core.network.is_offline():
+        missing = [input for input in inputs if not _is_available_offline(build, input)]
+
+        if len(missing) > 0:
+            stdlib.log.flog("The following inputs are neither cached nor in the local mirror, and can't be fetched offline:")
+            with stdlib.log.pushlog():
+                for input in missing:
+                    stdlib.log.elog(str(input.get('url') or input.get('git') or input.get('file')))
+            exit(1)
+
+    jobs = jobs or _get_fetch_config('jobs', 4)
+    jobs_per_host = jobs_per_host or _get_fetch_config('jobs_per_host', 2)
+
+    host_limits = dict()
+    for input in inputs:
+        if 'url' in input:
+            for url in _get_mirrors(input['url']):
+                host_limits.setdefault(urlparse(url).netloc, threading.BoundedSemaphore(jobs_per_host))
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = dict()
+        extractions = dict()
+        downloads = dict()  # Key = The path of a file in the download cache, Value = The index of the entry downloading it
+        shared = set()  # The indexes of the entries whose file is downloaded by a previous entry
+        for (index, input) in enumerate(inputs):
             if 'url' in input:
-                fetch_url(**input)
+                # An entry listed twice is downloaded once, as both downloads would write the same file at the same time
+                install_path = _get_install_path(build, input['url'])
+                if install_path in downloads:
+                    futures[index] = futures[downloads[install_path]]
+                    extractions[index] = None
+                    shared.add(index)
+                    continue
+                downloads[install_path] = index
+
+                extractions[index] = _get_extraction(input.get('extract'), input.get('include'), input.get('exclude'))
+                futures[index] = executor.submit(
+                    _call_buffered,
+                    stdlib.log.get_log_level(),
+                    _download_url,
+                    build,
+                    host_limits=host_limits,
+                    extraction=extractions[index],
+                    **_get_download_args(input),
+                )
+
+        for (index, input) in enumerate(inputs):
+            if index in futures:
+                lines, install_path, error = futures[index].result()
+                if index not in shared:
+                    stdlib.log.flushlog(lines)
+
+                if error is not None:
+                    for future in futures.values():
+                        future.cancel()
+                    raise error
+
+                # Copies are made here, so the build cache is filled in the order of the entries
+                _copy_to_build_cache(build, install_path, input.get('sha256'), input.get('include'), input.get('exclude'), extractions[index])
             elif 'file' in input:
                 fetch_file(**input)
             elif 'git' in input:
                 fetch_git(**input)
-        else:
-            raise ValueError("A single entry of data given to fetch() contains either no `url` or `file` key, or a mixture of them.")
+
+
+def prefetch(
+    builds,
+    jobs: int = None,
+    jobs_per_host: int = None,
+):
+    """Download the inputs of all the given builds in the caches, without building anything.
+
+    The entries of the versionized argument ``fetch`` of each build that are handled by :py:func:`.fetch_url` are downloaded in
+    the download cache of their build, and the git repositories of the entries handled by :py:func:`.fetch_git` are mirrored.
+    The builds that follow won't have to wait for the network anymore.
+
+    All the downloads of all the builds share the same pool of threads, so they are done concurrently. A file needed by several
+    builds (same SHA256, or same URL if it has none) is downloaded once, and linked in the download caches of the others. A failed
+    download doesn't stop the others: all the failures are listed at the end, and the program exits with an error.
+
+    Once done, the total number of bytes downloaded, the number of cache hits and the throughput of each host are printed.
+
+    :param builds: The builds whose inputs should be downloaded.
+    :type builds: ``List`` [ :py:class:`~stdlib.build.Build` ]
+    :param jobs: The maximum number of concurrent downloads. Same as for :py:func:`.fetch`.
+    :param jobs_per_host: The maximum number of concurrent downloads from the same host. Same as for :py:func:`.fetch`.
+    """
+    jobs = jobs or _get_fetch_config('jobs', 4)
+    jobs_per_host = jobs_per_host or _get_fetch_config('jobs_per_host', 2)
+
+    downloads = collections.OrderedDict()  # Key = The SHA256 of a file, or its URL, Value = A list of builds and entries of their `fetch` argument
+    repositories = dict()  # Key = The URL of a git repository, Value = A list of tags and commits to mirror
+    host_limits = dict()
+
+    for build in builds:
+        _check_install_paths(build, build.args.get('fetch', []))
+        os.makedirs(build.download_cache, exist_ok=True)
+
+        for input in build.args.get('fetch', []):
+            if 'url' in input:
+                # The same file may be an input of several builds, it is only downloaded once
+                key = input.get('sha256') or str(_get_mirrors(input['url']))
+                downloads.setdefault(key, []).append((build, input))
+                for url in _get_mirrors(input['url']):
+                    host_limits.setdefault(urlparse(url).netloc, threading.BoundedSemaphore(jobs_per_host))
+            elif 'git' in input and input.get('mirror', True):
+                repositories.setdefault(input['git'], []).append((input.get('tag'), input.get('commit')))
+
+    duplicates = sum(len(inputs) - 1 for inputs in downloads.values())
+    stdlib.log.slog(
+        f"Prefetching {len(downloads)} file(s) and {len(repositories)} git repositories for {len(builds)} build(s)"
+        + (f" ({duplicates} duplicate file(s) skipped)" if duplicates > 0 else "")
+    )
+
+    failures = list()
+    cache_hits = 0
+    start = time.monotonic()
+
+    all_stats = list()
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor, stdlib.log.pushlog():
+        futures = list()
+
+        for inputs in downloads.values():
+            stats = dict()
+            all_stats.append(stats)
+            futures.append((
+                inputs[0][1]['url'],
+                stats,
+                executor.submit(
+                    _call_buffered,
+                    stdlib.log.get_log_level(),
+                    _prefetch_url,
+                    inputs,
+                    host_limits,
+                    stats,
+                ),
+            ))
+
+        # Each repository is mirrored by a single thread, so a mirror is never written by two of them at the same time
+        for (git, refs) in repositories.items():
+            futures.append((
+                git,
+                None,
+                executor.submit(
+                    _call_buffered,
+                    stdlib.log.get_log_level(),
+                    _prefetch_git,
+                    git,
+                    refs,
+                ),
+            ))
+
+        for (name, stats, future) in futures:
+            lines, _, error = future.result()
+            stdlib.log.flushlog(lines)
+
+            if isinstance(error, KeyboardInterrupt):
+                raise error
+            elif error is not None:
+                failures.append(name)
+            elif stats is not None and len(stats) == 0:
+                cache_hits += 1
+
+    duration = time.monotonic() - start
+    downloaded = [stats for stats in all_stats if len(stats) > 0]
+
+    stdlib.log.slog(
+        f"Prefetch done in {duration:.1f}s: "
+        f"{_format_size(sum(stats['size'] for stats in downloaded))} downloaded, "
+        f"{len(downloaded)} file(s) fetched, {cache_hits} cache hit(s)"
+    )
+
+    with stdlib.log.pushlog():
+        for host in sorted(set(stats['host'] for stats in downloaded)):
+            host_stats = [stats for stats in downloaded if stats['host'] == host]
+            size = sum(stats['size'] for stats in host_stats)
+
+            # Downloads from the same host overlap, so the throughput is measured from the first start to the last end
+            host_duration = max(stats['end'] for stats in host_stats) - min(stats['start'] for stats in host_stats)
+            stdlib.log.ilog(
+                f"{host}: {_format_size(size)} in {len(host_stats)} file(s), "
+                f"{_format_size(size / max(host_duration, 0.001))}/s"
+            )
+
+    if len(failures) > 0:
+        stdlib.log.flog("The following inputs couldn't be prefetched:")
+        with stdlib.log.pushlog():
+            for name in failures:
+                stdlib.log.elog(str(name))
+        exit(1)
 
 
 def fetch_file(file: str, rename: str=None):
@@ -96,23 +332,35 @@ def fetch_file(file: str, rename: str=None):
             new_name,
         )
 
-        shutil.copytree(
+        methods = core.clone.copy_tree(
             srcpath,
             dstpath,
         )
     else:
-        shutil.copy(
+        methods = {core.clone.copy_file(
             srcpath,
             os.path.join(
                 build.build_cache,
                 new_name,
             )
-        )
+        ): 1}
+
+    if core.args.get_args().verbose >= 1:
+        stdlib.log.dlog(f"Copied {new_name} with {', '.join(f'{method} ({count} file(s))' for (method, count) in methods.items())}")
+
+    build.fetched.append(('file', new_name, _hash_tree(os.path.join(build.build_cache, new_name))))
 
     stdlib.log.slog(f"Fetched {file}.")
 
 
-def fetch_url(url: str, sha256: str = None):
+def fetch_url(
+    url: Union[str, List[str]],
+    sha256: str = None,
+    segments: int = None,
+    include: List[str] = None,
+    exclude: List[str] = None,
+    extract: Union[bool, str] = False,
+):
     """Download a file from an URL and ensure its integrity
 
     The downloaded file is put in the build cache of the current build, but a copy
@@ -120,57 +368,42 @@ def fetch_url(url: str, sha256: str = None):
     with the same ``url`` argument, the already-downloaded file will be copied
     instead, avoiding any extra download.
 
-    :note: Only HTTP, HTTPS and FTP protocols are supported.
+    If ``sha256`` is given, the downloaded file is also stored in the content cache (see :py:func:`~core.cache.get_content_cache`),
+    and any later call to :py:func:`.fetch_url` with the same ``sha256`` reuses it, whatever the build or the URL.
 
-    :param url: The URL pointing to the file to download.
-    :param sha256: The SHA256 used to ensure the integrity of the file.
-    """
-    build = stdlib.build.current_build()
+    ``url`` can also be a list of mirrors, all pointing to the same file. In that case, the mirrors are sorted by the time needed
+    to connect to them and tried one after another, the fastest first, until one of them provides the file. The SHA256 is then
+    the only reference of what the file should be, a mirror providing an invalid file being skipped like an unreachable one.
+    A mirror is given up on at its first failure (connection error, timeout or ``5xx`` status), only the last one is retried.
 
-    url_object = urlparse(url)
-    filename = os.path.basename(url_object.path)
-    build_path = os.path.join(
-        build.build_cache,
-        filename,
-    )
-    install_path = os.path.join(
-        build.download_cache,
-        filename,
-    )
+    If ``extract`` is given, a tarball that isn't cached is extracted in the extract cache (see :py:func:`~core.cache.get_extract_cache`)
+    while it is being downloaded, instead of being read again once downloaded. The extracted files are only kept if the tarball
+    read by the extraction has the expected SHA256, and are then moved to the build cache by :py:func:`~stdlib.extract.extract_all`
+    or :py:func:`~stdlib.extract.flat_extract_all` (whichever matches ``extract``) instead of extracting the tarball again.
+    Otherwise, the tarball is simply extracted by these functions, as usual.
 
-    if not sha256:
-        stdlib.log.wlog(f"No sha256 to ensure the integrity of {url}")
-
-    if os.path.exists(install_path) and _check_sha256(install_path, sha256):
-        stdlib.log.slog(f"Cache hit for {url}")
-        shutil.copy2(
-            install_path,
-            build_path
-        )
-    else:
-        stdlib.log.ilog(f"Cache miss for {url}, fetching now...")
-        if url_object.scheme == 'http' or url_object.scheme == 'https':
-            _download_http(url, install_path)
-        elif url_object.scheme == ('ftp'):
-            _download_ftp(url_object, install_path)
-        else:
-            stdlib.log.flog(f"Unknown protocol to download file from url {url}")
-            exit(1)
-
-        stdlib.log.slog(f"Fetch done.")
+    :note: Only HTTP, HTTPS, FTP and local (``file://``) URLs are supported.
+    :note: Tarballs are only extracted while they are downloaded if ``sha256`` is given, ``segments`` isn't, and their format
+        can be read as a stream (zip archives can't).
 
-        if sha256 and not _check_sha256(install_path, sha256):
-            stdlib.log.flog(
-                "Downloaded file's signature is invalid. "
-                "Please verify the signature(s) in the build manifest "
-                "and the authenticity of the given link."
-            )
-            exit(1)
+    :param url: The URL pointing to the file to download, or a list of URLs pointing to mirrors of that file.
+        The name of the downloaded file is taken from the first one.
+    :param sha256: The SHA256 used to ensure the integrity of the file.
+    :param segments: If not ``None``, the file is downloaded over HTTP(S) through ``segments`` connections at the same time, each
+        one downloading a different part of the file. This is useful for large files hosted on servers with a limited throughput
+        per connection. If the server doesn't support it, the file is downloaded through a single connection instead.
+    :param include: If the file is a tarball, the patterns of the members :py:func:`~stdlib.extract.extract_all` and
+        :py:func:`~stdlib.extract.flat_extract_all` should extract. See :py:mod:`stdlib.extract` for the format of the patterns.
+    :param exclude: If the file is a tarball, the patterns of the members :py:func:`~stdlib.extract.extract_all` and
+        :py:func:`~stdlib.extract.flat_extract_all` should skip.
+    :param extract: ``True`` to extract the tarball while it is being downloaded the way :py:func:`~stdlib.extract.extract_all` does,
+        ``flat`` to extract it the way :py:func:`~stdlib.extract.flat_extract_all` does. The default value is ``False``.
+    """
+    build = stdlib.build.current_build()
+    extraction = _get_extraction(extract, include, exclude)
 
-        shutil.copy2(
-            install_path,
-            build_path,
-        )
+    install_path = _download_url(build, url, sha256, segments, extraction=extraction)
+    _copy_to_build_cache(build, install_path, sha256, include, exclude, extraction)
 
 
 def fetch_git(
@@ -180,18 +413,28 @@ def fetch_git(
     branch: str = None,
     folder: str = '.',
     recursive: bool = True,
+    mirror: bool = True,
+    archive: bool = False,
 ):
-    """Download a file from an URL and ensure its integrity
-
-    The downloaded file is put in the build cache of the current build, but a copy
-    is also stored in the download cache. If :py:func:`.fetch_url` is called again
-    with the same ``url`` argument, the already-downloaded file will be copied
-    instead, avoiding any extra download.
+    """Clone a git repository and checkout the given tag, commit or branch.
 
-    :note: Only HTTP, HTTPS and FTP protocols are supported.
+    The repository is cloned from a bare mirror kept in the git cache (see :py:func:`~core.cache.get_git_cache`), which is created
+    the first time the repository is fetched and updated incrementally afterwards. The update is skipped if the mirror already
+    contains the given tag or commit. The clone shares its objects with the mirror, so only the working tree is written.
 
-    :param url: The URL pointing to the file to download.
-    :param sha256: The SHA256 used to ensure the integrity of the file.
+    :param git: The URL pointing to the git repository.
+    :param tag: The tag to checkout.
+    :param commit: The commit to checkout.
+    :param branch: The branch to checkout.
+    :param folder: The folder to clone the repository in, relative to the build cache. The default value is ``.``.
+    :param recursive: Indicate whether the submodules should also be fetched, in parallel. With ``--offline``, they are cloned from
+        their mirrors in the git cache or from the local mirror. The default value is ``True``.
+    :param mirror: Indicate whether the repository should go through a mirror. If ``False``, the repository is cloned directly,
+        with a shallow clone if a tag or branch is given, or a clone without any file content but the one of ``commit`` if it is given.
+        This is useful for huge repositories that are rarely fetched. The default value is ``True``.
+    :param archive: If ``True`` and ``commit`` is given, the checked-out files (including submodules, but without the git metadata)
+        are also stored as a tarball in the git cache, and later calls extract this tarball instead of using git at all.
+        The default value is ``False``.
     """
     build = stdlib.build.current_build()
 
@@ -206,36 +449,1121 @@ def fetch_git(
 
     # TODO FIXME: Use libgit instead of using shell commands.
 
+    archive_path = None
+    if archive and commit is not None:
+        archive_path = _get_git_archive_path(git, commit, recursive)
+
+        # The full hash of the commit is recorded, as it is after a clone, so an abbreviated commit gives the same snapshot key.
+        # Archives made before it was stored in them are made again.
+        head = _read_git_archive_head(archive_path)
+        if head is not None:
+            stdlib.log.slog(f"Cache hit for {git} ({commit})")
+            with stdlib.pushd(build.build_cache), tarfile.open(archive_path) as tar:
+                tar.extractall(folder)
+
+            build.fetched.append(('git', os.path.normpath(folder), f'{head}{"-recursive" if recursive else ""}'))
+            return
+
+    checkout = tag or branch or commit
+    jobs = _get_fetch_config('jobs', 4)
+    source = _get_git_source(git)
+
     with stdlib.pushd(build.build_cache):
-        stdlib.log.ilog(f"Cloning {git}...")
-        stdlib.cmd(f"git clone {'--recursive' if recursive else ''} {git} {folder}")
+        if mirror:
+            mirror_path = _update_git_mirror(git, source, tag, commit)
 
-        checkout = tag or branch or commit
-        if checkout is not None:
-            stdlib.log.ilog(f"Checking {checkout}...")
-            stdlib.cmd(f'git checkout {checkout}')
+            stdlib.log.ilog(f"Cloning {git}...")
+            stdlib.cmd(f"git clone --shared --no-checkout {shlex.quote(mirror_path)} {shlex.quote(folder)}")
 
+            # Relative URLs of submodules are resolved against the one of `origin`
+            stdlib.cmd(f"git -C {shlex.quote(folder)} remote set-url origin {shlex.quote(git)}")
+        elif source is None:
+            stdlib.log.flog(f"{git} isn't in the local mirror and can't be cloned offline")
+            exit(1)
+        elif commit is not None:
+            stdlib.log.ilog(f"Cloning {git} without file content...")
+            stdlib.cmd(f"git clone --filter=blob:none --no-checkout {shlex.quote(source)} {shlex.quote(folder)}")
+        else:
+            stdlib.log.ilog(f"Cloning {git} shallowly...")
+            branch_flag = f' --branch {shlex.quote(checkout)}' if checkout is not None else ''
+            stdlib.cmd(f"git clone --depth 1 --no-checkout{branch_flag} {shlex.quote(source)} {shlex.quote(folder)}")
 
-def _download_http(url, path):
-        req = requests.get(url, stream=True)
-        with open(path, 'wb') as file:
-            for chunk in req.iter_content(chunk_size=4096):
-                file.write(chunk)
+        stdlib.log.ilog(f"Checking {checkout or 'HEAD'}...")
+        stdlib.cmd(f"git -C {shlex.quote(folder)} checkout -f {shlex.quote(checkout or 'HEAD')}")
 
+        if recursive and core.network.is_offline():
+            stdlib.log.ilog(f"Fetching submodules from the local mirror...")
+            _update_submodules_offline(folder, jobs)
+        elif recursive:
+            stdlib.log.ilog(f"Fetching submodules...")
+            stdlib.cmd(f"git -C {shlex.quote(folder)} submodule update --init --recursive --jobs {jobs}")
 
-def _download_ftp(url_object, path):
-    ftp = ftplib.FTP(url_object.netloc)
-    ftp.login()
-    with open(path, 'wb') as out_file:
-        ftp.retrbinary(
-                f'RETR {url_object.path}',
-                lambda data: out_file.write(data),
-        )
+        head = subprocess.check_output(['git', '-C', folder, 'rev-parse', 'HEAD']).decode().strip()
+
+        if archive_path is not None:
+            stdlib.log.ilog(f"Archiving {commit}...")
+            _archive_git_tree(folder, archive_path, head)
+
+        build.fetched.append(('git', os.path.normpath(folder), f'{head}{"-recursive" if recursive else ""}'))
+
+
+def _prefetch_url(inputs, host_limits, stats):
+    """Download a file once, in the download cache of the first of ``inputs``, and link it in the download caches of the others.
+
+    :param inputs: A list of tuples made of a build and an entry of its ``fetch`` argument, all pointing to the same file.
+    :param host_limits: Same as for :py:func:`._download_url`.
+    :param stats: Same as for :py:func:`._download_url`.
+    """
+    (build, input) = inputs[0]
+    path = _download_url(build, host_limits=host_limits, stats=stats, **_get_download_args(input))
+
+    for (build, input) in inputs[1:]:
+        install_path = _get_install_path(build, input['url'])
+        _link_file(path, install_path)
+
+        # The metadata hold the SHA256 and validators of the file, which are the same for all its links
+        if os.path.exists(f'{path}.meta'):
+            _link_file(f'{path}.meta', f'{install_path}.meta')
+
+
+def _download_url(build, url, sha256=None, segments=None, host_limits=None, stats=None, extraction=None):
+    """Download a file from an URL, or a list of mirrors, in the download cache of ``build`` and ensure its integrity, unless it is already there.
+
+    :param host_limits: A dictionary with hosts as keys and semaphores as values, limiting the concurrent downloads from each host.
+    :param stats: A dictionary filled with the ``host`` the file was downloaded from, its ``size`` and the ``start`` and ``end``
+        of the download (as given by :py:func:`time.monotonic`). It is left empty if the file wasn't downloaded.
+    :param extraction: If not ``None``, the options to extract the file with while it is downloaded, as returned by
+        :py:func:`._get_extraction`. Its ``path`` is set to the directory the file was extracted in, if it was.
+    :returns: The path pointing to the downloaded file, in the download cache of ``build``.
+    """
+    urls = _get_mirrors(url)
+    filename = os.path.basename(urlparse(urls[0]).path)
+    install_path = _get_install_path(build, url)
+
+    if not sha256:
+        stdlib.log.wlog(f"No sha256 to ensure the integrity of {urls[0]}")
+
+    content_path = get_content_path(sha256) if sha256 else None
+
+    if content_path is not None and os.path.exists(content_path):
+        # Files of the content cache are checked before being added to it, so there is no need to do it twice
+        stdlib.log.slog(f"Cache hit for {urls[0]}")
+        _link_file(content_path, install_path)
+        _write_metadata(install_path, sha256=sha256)
+    elif os.path.exists(install_path) and _check_sha256(install_path, sha256):
+        stdlib.log.slog(f"Cache hit for {urls[0]}")
+        if content_path is not None:
+            _link_file(install_path, content_path)
+    elif os.path.exists(install_path) and not sha256 and core.network.is_offline():
+        stdlib.log.slog(f"Cache hit for {urls[0]} (not revalidated, offline)")
+    else:
+        # Without a SHA256, the validators sent by the server with the cached file tell whether it is still up to date
+        validators = _read_metadata(install_path) if not sha256 else dict()
+        etag = validators.get('etag')
+        last_modified = validators.get('last_modified')
+
+        if etag is not None or last_modified is not None:
+            stdlib.log.ilog(f"Revalidating cached {urls[0]}...")
+        else:
+            stdlib.log.ilog(f"Cache miss for {urls[0]}, fetching now...")
+
+        urls = _get_sources(urls, filename)
+        if len(urls) == 0:
+            stdlib.log.flog(f"{filename} isn't in the local mirror and can't be downloaded offline")
+            exit(1)
+
+        if len(urls) > 1:
+            urls = _sort_mirrors(urls)
+            stdlib.log.ilog(f"Fastest mirror: {urls[0]}")
+
+        # The extraction reads the file as it is written, and checks its SHA256 itself
+        pipeline = None
+        if extraction is not None and sha256 and not (segments is not None and segments > 1):
+            pipeline = _PipelinedExtraction(build, install_path, sha256, extraction)
+
+        try:
+            _download_mirrors(urls, install_path, sha256, segments, etag, last_modified, host_limits, stats)
+        finally:
+            if pipeline is not None and pipeline.finish():
+                extraction['path'] = pipeline.dest
+
+        if content_path is not None:
+            _link_file(install_path, content_path)
+
+    return install_path
+
+
+def _check_install_paths(build, inputs):
+    """Abort the build if two different entries of ``inputs`` handled by :py:func:`.fetch_url` would be downloaded in the same
+    file, like two ``archive/v1.0.tar.gz`` URLs of different repositories.
+
+    The same entry may be given twice, as it is only downloaded once.
+    """
+    downloads = dict()  # Key = The path of a file in the download cache, Value = The arguments it is downloaded with
+
+    for input in inputs:
+        if 'url' in input:
+            install_path = _get_install_path(build, input['url'])
+            args = _get_download_args(input)
+
+            if downloads.setdefault(install_path, args) != args:
+                stdlib.log.flog(
+                    f"{_get_mirrors(downloads[install_path]['url'])[0]} and {_get_mirrors(input['url'])[0]} would both be downloaded "
+                    f"as {os.path.basename(install_path)}"
+                )
+                exit(1)
+
+
+def _get_install_path(build, url):
+    """Return the path of the file downloaded from ``url`` (or its list of mirrors) in the download cache of ``build``."""
+    return os.path.join(
+        build.download_cache,
+        os.path.basename(urlparse(_get_mirrors(url)[0]).path),
+    )
+
+
+def _download_mirrors(urls, install_path, sha256, segments, etag, last_modified, host_limits, stats):
+    """Download a file from the first of ``urls`` providing it, in ``install_path``. See :py:func:`._download_url`."""
+    for (index, url) in enumerate(urls):
+        next_url = urls[index + 1] if index + 1 < len(urls) else None
+
+        try:
+            with _limit_host(host_limits, url):
+                start = time.monotonic()
+                # The next mirror is tried as soon as this one fails, only the last one is retried
+                metadata = _download(url, install_path, segments, etag, last_modified, retries=None if next_url is None else 0)
+        except (requests.RequestException, ftplib.Error, OSError, EOFError) as e:
+            if next_url is None:
+                stdlib.log.flog(f"Failed to download {url}: {e}")
+                exit(1)
+
+            stdlib.log.wlog(f"Failed to download {url} ({e}), trying {next_url}...")
+            continue
+
+        if metadata is None:
+            stdlib.log.slog(f"Cache hit for {url} (not modified)")
+            return
+
+        stdlib.log.slog(f"Fetch done.")
+
+        if stats is not None:
+            stats.update(
+                host=urlparse(url).netloc or url,
+                size=os.path.getsize(install_path),
+                start=start,
+                end=time.monotonic(),
+            )
+
+        _write_metadata(install_path, **metadata)
+
+        if sha256 and metadata['sha256'] != sha256:
+            if next_url is None:
+                stdlib.log.flog(
+                    "Downloaded file's signature is invalid. "
+                    "Please verify the signature(s) in the build manifest "
+                    "and the authenticity of the given link."
+                )
+                exit(1)
+
+            stdlib.log.wlog(f"The signature of the file provided by {url} is invalid, trying {next_url}...")
+            os.remove(install_path)
+            continue
+
+        return
+
+
+def _download(url, path, segments=None, etag=None, last_modified=None, retries=None):
+    """Download the file pointed to by ``url`` in ``path``, using the appropriate protocol.
+
+    :param retries: The number of times an interrupted download is retried. The default value is the value of ``retries`` in the
+        ``[fetch]`` section of the configuration file, or ``5`` if there is none.
+
+    :returns: The same as :py:func:`._download_http`.
+    """
+    url_object = urlparse(url)
+
+    if (url_object.scheme == 'http' or url_object.scheme == 'https') and segments is not None and segments > 1:
+        return _download_http_segmented(url, path, segments, etag, last_modified, retries)
+    elif url_object.scheme == 'http' or url_object.scheme == 'https':
+        return _download_http(url, path, etag, last_modified, retries)
+    elif url_object.scheme == ('ftp'):
+        return _download_ftp(url_object, path, retries)
+    elif url_object.scheme == 'file':
+        return _download_file(url_object, path)
+    else:
+        stdlib.log.flog(f"Unknown protocol to download file from url {url}")
+        exit(1)
+
+
+def _get_mirrors(url):
+    return [url] if isinstance(url, str) else list(url)
+
+
+def _get_sources(urls, filename):
+    """Return the URLs to try to download ``filename`` from.
+
+    These are ``urls``, preceded by the local mirror if it contains ``filename``, without the network ones if offline.
+    """
+    local_mirror = _get_local_mirror()
+
+    if local_mirror is not None and os.path.isfile(os.path.join(local_mirror, filename)):
+        urls = [f'file://{pathname2url(os.path.join(local_mirror, filename))}'] + urls
+
+    if core.network.is_offline():
+        urls = [url for url in urls if urlparse(url).scheme == 'file']
+    return urls
+
+
+def _get_local_mirror():
+    local_mirror = _get_fetch_config('local_mirror', None)
+
+    if local_mirror is not None and urlparse(local_mirror).scheme == 'file':
+        local_mirror = url2pathname(urlparse(local_mirror).path)
+    return local_mirror
+
+
+def _is_available_offline(build, input):
+    """Test whether the given entry of ``fetch`` can be fetched without using the network."""
+    if 'file' in input:
+        return os.path.exists(os.path.join(os.path.dirname(build.manifest.path), input['file']))
+    elif 'url' in input:
+        urls = _get_mirrors(input['url'])
+        filename = os.path.basename(urlparse(urls[0]).path)
+        sha256 = input.get('sha256')
+        install_path = os.path.join(build.download_cache, filename)
+
+        if sha256 and os.path.exists(get_content_path(sha256)):
+            return True
+        elif os.path.exists(install_path) and (not sha256 or _check_sha256(install_path, sha256)):
+            return True
+        return any(os.path.exists(url2pathname(urlparse(url).path)) for url in _get_sources(urls, filename))
+    else:
+        git = input['git']
+        commit = input.get('commit')
+        tag = input.get('tag')
+        mirror_path = _get_git_mirror_path(git)
+
+        if input.get('archive') and commit is not None:
+            if _read_git_archive_head(_get_git_archive_path(git, commit, input.get('recursive', True))) is not None:
+                return True
+
+        if input.get('mirror', True) and os.path.exists(mirror_path):
+            if commit is not None:
+                return _git_succeeds(mirror_path, 'cat-file', '-e', f'{commit}^{{commit}}')
+            elif tag is not None:
+                return _git_succeeds(mirror_path, 'rev-parse', '-q', '--verify', f'refs/tags/{tag}')
+            return True
+        return _get_git_source(git) is not None
+
+
+def _sort_mirrors(urls):
+    """Sort ``urls`` by the time needed to connect to their host, the fastest first.
+
+    All hosts are probed at the same time. The unreachable ones are moved at the end, in their original order.
+    """
+    timeout = _get_fetch_config('probe_timeout', 5)
+
+    with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+        latencies = list(executor.map(lambda url: _probe_mirror(url, timeout), urls))
+
+    return [url for (_, url) in sorted(zip(latencies, urls), key=lambda pair: pair[0])]
+
+
+def _probe_mirror(url, timeout):
+    url_object = urlparse(url)
+    if url_object.scheme == 'file':
+        return 0
+    port = url_object.port or {'http': 80, 'https': 443, 'ftp': 21}.get(url_object.scheme)
+
+    start = time.monotonic()
+    try:
+        with socket.create_connection((url_object.hostname, port), timeout=timeout):
+            pass
+    except (OSError, TypeError):
+        return math.inf
+    return time.monotonic() - start
+
+
+def _limit_host(host_limits, url):
+    """Return a context manager limiting the number of concurrent downloads from the host of ``url`` according to ``host_limits``."""
+    host_limit = (host_limits or dict()).get(urlparse(url).netloc)
+    return host_limit if host_limit is not None else contextlib.ExitStack()
+
+
+def _call_buffered(log_level, function, *args, **kwargs):
+    """Call ``function`` with the given arguments, holding back its logs, indented by ``log_level`` (the indentation level of the
+    calling thread).
+
+    :returns: A tuple made of the lines logged, the return value of ``function`` and the exception it raised, if any.
+    """
+    with stdlib.log.bufferlog() as lines, stdlib.log.indentlog(log_level):
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as error:  # Also catch `exit()`, so it is forwarded to the calling thread
+            return lines, None, error
+    return lines, result, None
+
+
+def _copy_to_build_cache(build, install_path, sha256=None, include=None, exclude=None, extraction=None):
+    name = os.path.basename(install_path)
+
+    method = core.clone.copy_file(
+        install_path,
+        os.path.join(
+            build.build_cache,
+            name,
+        ),
+    )
+    if core.args.get_args().verbose >= 1:
+        stdlib.log.dlog(f"Copied {name} with {method}")
+
+    # The SHA256 of a downloaded file is stored in its metadata, so the file is only read if they are outdated
+    build.fetched.append(('url', name, sha256 or _get_sha256(install_path)))
+    if include is not None or exclude is not None:
+        build.extract_filters[name] = {'include': include, 'exclude': exclude}
+    if extraction is not None and 'path' in extraction:
+        build.staged_extractions[name] = extraction
+
+
+def _get_download_args(input):
+    """Return the values of an entry of ``fetch`` used to download it, leaving out the ones used once it is downloaded."""
+    return {key: value for (key, value) in input.items() if key not in ['include', 'exclude', 'extract']}
+
+
+def _get_extraction(extract, include, exclude):
+    """Return the options to extract a file with while it is downloaded (see :py:func:`.fetch_url`), or ``None`` if it shouldn't be."""
+    if not extract:
+        return None
+    if extract is not True and extract != 'flat':
+        raise ValueError(f"fetch_url() received an invalid `extract` value: {extract!r}, while it expects `True` or `'flat'`")
+    return {'flat': extract == 'flat', 'include': include, 'exclude': exclude}
+
+
+class _PipelinedExtraction():
+    """Extract a tarball in the extract cache while it is being downloaded by another thread.
+
+    The tarball is read from the file it is downloaded to, as it grows (see :py:class:`._GrowingFile`), so the download is never
+    slowed down by the extraction.
+
+    :ivar dest: The directory the tarball is extracted in.
+    :vartype dest: ``str``
+    """
+    def __init__(self, build, install_path, sha256, extraction):
+        self.name = os.path.basename(install_path)
+        self.sha256 = sha256
+        self.extraction = extraction
+        self.dest = os.path.join(get_extract_cache(build), self.name)
+        self.done = threading.Event()
+        self.stream = _GrowingFile(f'{install_path}.part', install_path, self.done)
+        self.lines = list()
+        self.log_level = stdlib.log.get_log_level()
+        self.error = None
+
+        shutil.rmtree(self.dest, ignore_errors=True)
+        os.makedirs(self.dest)
+
+        self.thread = threading.Thread(target=self._extract)
+        self.thread.start()
+
+    def _extract(self):
+        with stdlib.log.bufferlog(self.lines), stdlib.log.indentlog(self.log_level):
+            try:
+                stdlib.extract.extract_stream(
+                    self.stream,
+                    self.name,
+                    self.dest,
+                    flat=self.extraction['flat'],
+                    include=self.extraction['include'],
+                    exclude=self.extraction['exclude'],
+                )
+            except BaseException as error:  # Also catch `exit()`, the tarball is then extracted later as usual
+                self.error = error
+            finally:
+                self.stream.close()
+
+    def finish(self) -> bool:
+        """Wait for the extraction to end, once the download ended, successfully or not.
+
+        :returns: Whether the tarball was entirely extracted, and the content read by the extraction has the expected SHA256.
+            The extracted files are removed otherwise.
+        """
+        self.done.set()
+        self.thread.join()
+
+        if self.error is None and self.stream.sha256() == self.sha256:
+            stdlib.log.flushlog(self.lines)
+            stdlib.log.slog(f"Extracted {self.name} while downloading it")
+            return True
+
+        if self.error is not None:
+            stdlib.log.wlog(f"Failed to extract {self.name} while downloading it, it will be extracted once downloaded")
+            if core.args.get_args().verbose >= 1:
+                with stdlib.log.pushlog():
+                    stdlib.log.flushlog(self.lines)
+                    stdlib.log.dlog(repr(self.error))
+
+        shutil.rmtree(self.dest, ignore_errors=True)
+        return False
+
+
+class _GrowingFile():
+    """A file being downloaded by another thread, read from its beginning as it is written, and hashed along the way.
+
+    :py:meth:`.read` waits for more data at the end of the file, until ``done`` is set. The ``.part`` file is read if it exists,
+    otherwise the final file is read once ``done`` is set (if the download was too fast to see the ``.part`` file).
+    """
+    def __init__(self, part_path, path, done):
+        self.part_path = part_path
+        self.path = path
+        self.done = done
+        self.file = None
+        self.hasher = hashlib.sha256()
+
+    def read(self, size=-1) -> bytes:
+        while self.file is None:
+            try:
+                self.file = open(self.part_path, 'rb')
+            except FileNotFoundError:
+                if self.done.is_set():
+                    try:
+                        self.file = open(self.path, 'rb')
+                    except FileNotFoundError:
+                        return b''
+                else:
+                    time.sleep(_FOLLOW_DELAY)
+
+        while True:
+            # `done` must be checked before reading, so no data written before it was set is missed
+            done = self.done.is_set()
+            data = self.file.read(size if size is not None and size >= 0 else _HASH_BUFFER_SIZE)
+
+            if data or done:
+                self.hasher.update(data)
+                return data
+            time.sleep(_FOLLOW_DELAY)
+
+    def sha256(self) -> str:
+        """Return the SHA256 of the data read so far."""
+        return self.hasher.hexdigest()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+def _prefetch_git(git, refs):
+    """Create or update the mirror of the git repository pointed to by ``git``, ensuring it contains all the tags and commits in ``refs``."""
+    source = _get_git_source(git)
+
+    for (tag, commit) in refs:
+        _update_git_mirror(git, source, tag, commit)
+
+
+def _update_git_mirror(git, source, tag, commit):
+    """Create or update the mirror of the git repository pointed to by ``git``.
+
+    :param source: The URL or path to create the mirror from, as returned by :py:func:`._get_git_source`.
+    :returns: The path pointing to the mirror.
+    """
+    mirror_path = _get_git_mirror_path(git)
+
+    if not os.path.exists(mirror_path):
+        if source is None:
+            stdlib.log.flog(f"{git} is neither mirrored nor in the local mirror, and can't be cloned offline")
+            exit(1)
+
+        stdlib.log.ilog(f"Mirroring {git}...")
+
+        tmp_path = f'{mirror_path}.tmp'
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        stdlib.cmd(f"git clone --mirror {shlex.quote(source)} {shlex.quote(tmp_path)}")
+        os.rename(tmp_path, mirror_path)
+    elif core.network.is_offline():
+        stdlib.log.wlog(f"Mirror of {git} not updated, offline")
+    elif commit is not None and _git_succeeds(mirror_path, 'cat-file', '-e', f'{commit}^{{commit}}'):
+        stdlib.log.slog(f"Mirror of {git} already contains {commit}")
+    elif tag is not None and _git_succeeds(mirror_path, 'rev-parse', '-q', '--verify', f'refs/tags/{tag}'):
+        stdlib.log.slog(f"Mirror of {git} already contains {tag}")
+    else:
+        stdlib.log.ilog(f"Updating mirror of {git}...")
+        stdlib.cmd(f"git -C {shlex.quote(mirror_path)} remote update --prune")
+
+    return mirror_path
+
+
+def _get_git_source(git):
+    """Return the path of the repository pointed to by ``git`` in the local mirror if it is there, ``git`` otherwise, or ``None`` if offline."""
+    local_mirror = _get_local_mirror()
+
+    if local_mirror is not None:
+        local_path = os.path.join(local_mirror, os.path.basename(urlparse(git).path.rstrip('/')))
+        if os.path.isdir(local_path):
+            return local_path
+    return git if not core.network.is_offline() else None
+
+
+def _update_submodules_offline(folder, jobs):
+    """Check out the submodules of the repository in ``folder``, recursively, without using the network.
+
+    Each submodule is cloned from its mirror in the git cache, or from the local mirror. If any submodule is in neither of them,
+    the complete list of missing submodules is printed and the build is aborted.
+    """
+    stdlib.cmd(f"git -C {shlex.quote(folder)} submodule init")
+
+    # The URLs of the submodules, resolved against the one of `origin` by `git submodule init`
+    urls = _git_config(folder, r'^submodule\..*\.url$')
+    missing = list()
+
+    for (key, url) in urls.items():
+        source = _get_offline_git_source(url)
+        if source is None:
+            missing.append(url)
+        else:
+            stdlib.cmd(f"git -C {shlex.quote(folder)} config {shlex.quote(key)} {shlex.quote(source)}")
+
+    if len(missing) > 0:
+        stdlib.log.flog(f"The following submodules of {folder} are neither mirrored nor in the local mirror, and can't be fetched offline:")
+        with stdlib.log.pushlog():
+            for url in missing:
+                stdlib.log.elog(url)
+        exit(1)
+
+    # Git refuses to clone submodules from local paths unless it is explicitly allowed
+    stdlib.cmd(f"git -C {shlex.quote(folder)} -c protocol.file.allow=always submodule update --jobs {jobs}")
+
+    paths = _git_config(folder, r'^submodule\..*\.path$', file='.gitmodules')
+    for path in paths.values():
+        if os.path.exists(os.path.join(folder, path, '.gitmodules')):
+            _update_submodules_offline(os.path.join(folder, path), jobs)
+
+
+def _get_offline_git_source(git):
+    """Return the path of a local copy of the repository pointed to by ``git``, or ``None`` if there is none."""
+    url_object = urlparse(git)
+
+    if url_object.scheme == 'file':
+        return url2pathname(url_object.path)
+    elif url_object.scheme == '' and os.path.isabs(git):
+        return git
+    elif os.path.exists(_get_git_mirror_path(git)):
+        return _get_git_mirror_path(git)
+    return _get_git_source(git)
+
+
+def _git_config(repository, regexp, file=None):
+    """Return the values of the git configuration of ``repository`` (or of ``file``, relative to it) whose key matches ``regexp``."""
+    file_args = ['-f', os.path.join(repository, file)] if file is not None else []
+    output = subprocess.run(
+        ['git', '-C', repository, 'config', *file_args, '-z', '--get-regexp', regexp],
+        stdout=subprocess.PIPE,
+    ).stdout.decode()
+
+    # With `-z`, each entry is a key and its value separated by a line break
+    return dict(entry.split('\n', 1) for entry in output.split('\0') if entry)
+
+
+def _get_git_mirror_path(git):
+    return os.path.join(
+        get_git_cache(),
+        'mirrors',
+        f'{_get_git_cache_name(git)}.git',
+    )
+
+
+def _get_git_archive_path(git, commit, recursive):
+    return os.path.join(
+        get_git_cache(),
+        'archives',
+        f'{_get_git_cache_name(git)}-{commit}{"-recursive" if recursive else ""}.tar',
+    )
+
+
+def _read_git_archive_head(archive_path):
+    """Return the full hash of the commit the archive pointed to by ``archive_path`` was made from, or ``None`` if it doesn't exist
+    or doesn't record it.
+    """
+    if not os.path.exists(archive_path):
+        return None
+
+    with tarfile.open(archive_path) as tar:
+        return tar.pax_headers.get('comment')
+
+
+def _archive_git_tree(folder, archive_path, head):
+    files = subprocess.run(
+        ['git', '-C', folder, 'ls-files', '-z', '--recurse-submodules'],
+        stdout=subprocess.PIPE,
+        check=True,
+    ).stdout.decode().split('\0')
+
+    os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+
+    tmp_path = f'{archive_path}.tmp'
+    # Like `git archive`, the hash of the commit is stored in the comment of the global header of the tarball
+    with tarfile.open(tmp_path, mode='w', format=tarfile.PAX_FORMAT, pax_headers={'comment': head}) as tar:
+        for file in filter(None, files):
+            tar.add(os.path.join(folder, file), arcname=file, recursive=False)
+    os.replace(tmp_path, archive_path)
+
+
+def _git_succeeds(repository, *args):
+    return subprocess.run(
+        ['git', '-C', repository, *args],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    ).returncode == 0
+
+
+def _get_git_cache_name(git):
+    name = os.path.basename(urlparse(git).path.rstrip('/'))
+    if name.endswith('.git'):
+        name = name[:-len('.git')]
+    return f'{name}-{hashlib.sha256(git.encode()).hexdigest()[:16]}'
+
+
+def _get_fetch_config(key, default):
+    return (core.config.get_config() or {}).get('fetch', {}).get(key, default)
+
+
+def _download_http(url, path, etag=None, last_modified=None, retries=None):
+    """Download the file pointed to by ``url`` in ``path``.
+
+    The file is first downloaded next to ``path``, with a ``.part`` extension, and then atomically renamed to ``path`` once complete.
+    If the download is interrupted, it is retried after an exponentially growing delay, resuming where it stopped if the server
+    supports it. A ``.part`` file left by a previous run is resumed the same way. A download is only resumed with the ``If-Range``
+    header, holding the validator (``ETag`` or ``Last-Modified``) the server sent with the beginning of the file, so the file is
+    downloaded from the start again if it changed in the meantime. It isn't resumed if the server sent no validator.
+
+    If ``etag`` or ``last_modified`` is given, the file is only downloaded if it changed since the server sent these values.
+
+    :param retries: Same as for :py:func:`._download`.
+    :returns: A dictionary with the SHA256 of the downloaded file, computed while it is being downloaded, and the ``etag`` and
+        ``last_modified`` values sent by the server, if any. ``None`` is returned instead if the file did not change.
+    """
+    part_path = f'{path}.part'
+    retries = _get_fetch_config('retries', 5) if retries is None else retries
+    retry_delay = _get_fetch_config('retry_delay', 1)
+    session = core.network.get_session(retries=False)
+    response_etag = None
+    response_last_modified = None
+
+    for attempt in range(retries + 1):
+        try:
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            headers = dict()
+
+            if offset > 0:
+                # Without a validator, the part already downloaded may belong to another version of the file
+                validator = _read_part_validator(part_path)
+                if validator is not None:
+                    headers['Range'] = f'bytes={offset}-'
+                    headers['If-Range'] = validator
+                else:
+                    offset = 0
+
+            if offset == 0 and etag is not None:
+                headers['If-None-Match'] = etag
+            if offset == 0 and last_modified is not None:
+                headers['If-Modified-Since'] = last_modified
+
+            with session.get(url, headers=headers, stream=True, timeout=core.network.get_timeout()) as req:
+                if req.status_code == 304:
+                    return None
+
+                if req.status_code == 416:
+                    # The server has nothing past `offset`: either the previous run stopped right before the rename,
+                    # or the `.part` file is bogus and the download must start over.
+                    if req.headers.get('Content-Range') == f'bytes */{offset}':
+                        hasher = _hash_file(part_path)
+                        break
+                    os.remove(part_path)
+                    raise requests.exceptions.ContentDecodingError("The partially downloaded file is invalid")
+
+                req.raise_for_status()
+
+                response_etag = req.headers.get('ETag')
+                response_last_modified = req.headers.get('Last-Modified')
+
+                # The server may ignore the `Range` header, or the file may have changed, and the whole file is sent instead
+                mode = 'ab' if req.status_code == 206 else 'wb'
+                hasher = _hash_file(part_path) if mode == 'ab' else hashlib.sha256()
+                expected_size = req.headers.get('Content-Length') if 'Content-Encoding' not in req.headers else None
+                size = 0
+
+                if mode == 'wb':
+                    _write_part_validator(part_path, response_etag, response_last_modified)
+
+                with open(part_path, mode) as file:
+                    for chunk in req.iter_content(chunk_size=_READ_BUFFER_SIZE):
+                        file.write(chunk)
+                        file.flush()
+                        hasher.update(chunk)
+                        size += len(chunk)
+
+                if expected_size is not None and size != int(expected_size):
+                    raise requests.exceptions.ChunkedEncodingError(f"Connection closed after {size} out of {expected_size} bytes")
+            break
+        except requests.RequestException as e:
+            if isinstance(e, requests.HTTPError) and e.response.status_code < 500:
+                raise
+            if attempt == retries:
+                raise
+
+            delay = retry_delay * 2 ** attempt
+            stdlib.log.wlog(f"Download of {url} interrupted ({e}), retrying in {delay}s...")
+            time.sleep(delay)
+
+    os.replace(part_path, path)
+    _write_part_validator(part_path, None, None)
+
+    metadata = {'sha256': hasher.hexdigest(), 'etag': response_etag, 'last_modified': response_last_modified}
+    return {key: value for (key, value) in metadata.items() if value is not None}
+
+
+def _read_part_validator(part_path):
+    """Return the validator to resume the download of the ``.part`` file pointed to by ``part_path`` with, or ``None`` if there is none."""
+    try:
+        with open(f'{part_path}.validator') as file:
+            return file.read().strip() or None
+    except OSError:
+        return None
+
+
+def _write_part_validator(part_path, etag, last_modified):
+    """Store the validator of the ``.part`` file pointed to by ``part_path``, or remove it if there is none.
+
+    Weak ETags can't be used to resume a download, so ``last_modified`` is used instead.
+    """
+    validator = etag if etag is not None and not etag.startswith('W/') else last_modified
+
+    if validator is None:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(f'{part_path}.validator')
+    else:
+        with open(f'{part_path}.validator', 'w') as file:
+            file.write(validator)
+
+
+def _download_http_segmented(url, path, segments, etag=None, last_modified=None, retries=None):
+    """Download the file pointed to by ``url`` in ``path`` through ``segments`` connections at the same time.
+
+    Each connection downloads its own range of the file and writes it at its place in a preallocated ``.part`` file, which is
+    renamed to ``path`` once complete. The SHA256 of the whole file is computed at the end.
+
+    If the server doesn't advertise the size of the file or the support of ranges, or if the file changes during the download,
+    it falls back to :py:func:`._download_http`.
+
+    :returns: The same as :py:func:`._download_http`.
+    """
+    session = core.network.get_session(retries=False)
+
+    headers = dict()
+    if etag is not None:
+        headers['If-None-Match'] = etag
+    if last_modified is not None:
+        headers['If-Modified-Since'] = last_modified
+
+    req = session.head(url, headers=headers, allow_redirects=True, timeout=core.network.get_timeout())
+    if req.status_code == 304:
+        return None
+    req.raise_for_status()
+
+    size = int(req.headers.get('Content-Length', 0))
+    response_etag = req.headers.get('ETag')
+    response_last_modified = req.headers.get('Last-Modified')
+
+    if req.headers.get('Accept-Ranges') != 'bytes' or 'Content-Encoding' in req.headers or size < segments:
+        stdlib.log.wlog(f"The server of {url} doesn't support segmented downloads, falling back to a single connection")
+        return _download_http(url, path, etag, last_modified, retries)
+
+    # This isn't the `.part` file of `_download_http()`, as it would be mistaken for a file whose beginning is already downloaded
+    part_path = f'{path}.segments.part'
+    segment_size = -(-size // segments)
+
+    log_buffer = stdlib.log.get_log_buffer()
+    log_level = stdlib.log.get_log_level()
+
+    fd = os.open(part_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        if hasattr(os, 'posix_fallocate'):
+            os.posix_fallocate(fd, 0, size)
+        else:
+            os.ftruncate(fd, size)
+
+        with ThreadPoolExecutor(max_workers=segments) as executor:
+            futures = [
+                executor.submit(
+                    _download_http_segment,
+                    url,
+                    fd,
+                    start,
+                    min(start + segment_size, size) - 1,
+                    response_etag,
+                    retries,
+                    log_buffer,
+                    log_level,
+                )
+                for start in range(0, size, segment_size)
+            ]
+            for future in futures:
+                future.result()
+    except _SegmentedDownloadUnsupported:
+        os.remove(part_path)
+        stdlib.log.wlog(f"The file pointed to by {url} changed during the download, falling back to a single connection")
+        return _download_http(url, path, etag, last_modified, retries)
+    except BaseException:
+        os.remove(part_path)
+        raise
+    finally:
+        os.close(fd)
+
+    os.replace(part_path, path)
+
+    metadata = {'sha256': _hash_file(path).hexdigest(), 'etag': response_etag, 'last_modified': response_last_modified}
+    return {key: value for (key, value) in metadata.items() if value is not None}
+
+
+class _SegmentedDownloadUnsupported(Exception):
+    pass
+
+
+def _download_http_segment(url, fd, start, end, etag, retries, log_buffer, log_level):
+    """Download the bytes ``start`` to ``end`` (included) of the file pointed to by ``url`` and write them at the same offset in ``fd``.
+
+    Logs are appended to ``log_buffer`` if it isn't ``None``, so they are printed along with the ones of the calling thread, and indented
+    by ``log_level`` like them.
+    """
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(stdlib.log.indentlog(log_level))
+        if log_buffer is not None:
+            stack.enter_context(stdlib.log.bufferlog(log_buffer))
+        _download_http_range(url, fd, start, end, etag, retries)
+
+
+def _download_http_range(url, fd, start, end, etag, retries):
+    retries = _get_fetch_config('retries', 5) if retries is None else retries
+    retry_delay = _get_fetch_config('retry_delay', 1)
+    session = core.network.get_session(retries=False)
+
+    for attempt in range(retries + 1):
+        try:
+            headers = {'Range': f'bytes={start}-{end}'}
+            if etag is not None:
+                headers['If-Range'] = etag
+
+            with session.get(url, headers=headers, stream=True, timeout=core.network.get_timeout()) as req:
+                req.raise_for_status()
+
+                # The server sends the whole file if it changed or if it doesn't honor ranges after all
+                if req.status_code != 206:
+                    raise _SegmentedDownloadUnsupported()
+
+                for chunk in req.iter_content(chunk_size=_HASH_BUFFER_SIZE):
+                    chunk = chunk[:end + 1 - start]
+                    os.pwrite(fd, chunk, start)
+                    start += len(chunk)
+
+            if start <= end:
+                raise requests.exceptions.ChunkedEncodingError(f"Connection closed {end + 1 - start} bytes before the end of the segment")
+            return
+        except requests.RequestException as e:
+            if isinstance(e, requests.HTTPError) and e.response.status_code < 500:
+                raise
+            if attempt == retries:
+                raise
+
+            delay = retry_delay * 2 ** attempt
+            stdlib.log.wlog(f"Download of a segment of {url} interrupted ({e}), retrying in {delay}s...")
+            time.sleep(delay)
+
+
+def _download_file(url_object, path):
+    """Copy the local file pointed to by ``url_object``, a ``file://`` URL, in ``path``.
+
+    :returns: A dictionary with the SHA256 of the copied file.
+    """
+    part_path = f'{path}.part'
+    hasher = hashlib.sha256()
+
+    with open(url2pathname(url_object.path), 'rb') as in_file, open(part_path, 'wb') as out_file:
+        for chunk in iter(lambda: in_file.read(_HASH_BUFFER_SIZE), b''):
+            out_file.write(chunk)
+            hasher.update(chunk)
+
+    os.replace(part_path, path)
+    return {'sha256': hasher.hexdigest()}
+
+
+def _download_ftp(url_object, path, retries=None):
+    """Download the file pointed to by ``url_object``, an FTP URL, in ``path``.
+
+    The connection is borrowed from the pool of :py:func:`core.network.ftp_connection`. Like :py:func:`._download_http`, the file
+    is first downloaded with a ``.part`` extension, and an interrupted download is retried, resuming where it stopped (using ``REST``)
+    if the server supports it.
+
+    :returns: A dictionary with the SHA256 of the downloaded file, computed while it is being downloaded.
+    """
+    part_path = f'{path}.part'
+    retries = _get_fetch_config('retries', 5) if retries is None else retries
+    retry_delay = _get_fetch_config('retry_delay', 1)
+
+    def write(data):
+        out_file.write(data)
+        hasher.update(data)
+
+    for attempt in range(retries + 1):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+
+        try:
+            with core.network.ftp_connection(url_object) as ftp:
+                hasher = _hash_file(part_path) if offset > 0 else hashlib.sha256()
+
+                # `SIZE` is only an extension, so the size of the file is unknown if the server doesn't support it
+                ftp.voidcmd('TYPE I')
+                try:
+                    size = ftp.size(url_object.path)
+                except ftplib.error_perm:
+                    size = None
+
+                # Either the previous run stopped right before the rename, or the `.part` file is bogus and the download must start over
+                if offset > 0 and offset == size:
+                    break
+                elif size is not None and offset > size:
+                    os.remove(part_path)
+                    offset = 0
+                    hasher = hashlib.sha256()
+
+                with open(part_path, 'ab' if offset > 0 else 'wb') as out_file:
+                    ftp.retrbinary(
+                        f'RETR {url_object.path}',
+                        write,
+                        blocksize=_FTP_BLOCK_SIZE,
+                        rest=offset if offset > 0 else None,
+                    )
+            break
+        except ftplib.error_perm:
+            # The server may refuse to resume the download, but a missing file or a refused login won't get any better
+            if offset == 0 or attempt == retries:
+                raise
+            os.remove(part_path)
+        except (ftplib.Error, OSError, EOFError) as e:
+            if attempt == retries:
+                raise
+
+            delay = retry_delay * 2 ** attempt
+            stdlib.log.wlog(f"Download of {url_object.geturl()} interrupted ({e}), retrying in {delay}s...")
+            time.sleep(delay)
+
+    os.replace(part_path, path)
+    return {'sha256': hasher.hexdigest()}
+
+
+def _link_file(src, dst):
+    """Make ``dst`` a hard link to ``src``, or a copy of it (see :py:func:`core.clone.copy_file`) if they are on different file systems.
+
+    ``dst`` is replaced atomically if it already exists, and its parent directories are created if needed.
+    """
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+
+    # Renaming a link over another link to the same file does nothing, leaving the temporary link behind
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        return
+
+    tmp_path = f'{dst}.{threading.get_ident()}.tmp'
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        core.clone.copy_file(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+
+def _format_size(size):
+    for unit in ['B', 'KiB', 'MiB', 'GiB', 'TiB']:
+        if size < 1024:
+            break
+        size /= 1024
+    return f'{size:.1f} {unit}'
 
 
 def _check_sha256(path, sha256):
-    hash_sha256 = hashlib.sha256()
+    """Test whether the SHA256 of the file pointed to by ``path`` is ``sha256``.
+
+    The file is only read if its size or modification time changed since its SHA256 was last written in its metadata.
+    """
+    if sha256 is None:
+        return False
+    return _get_sha256(path) == sha256
+
+
+def _get_sha256(path):
+    """Return the SHA256 of the downloaded file pointed to by ``path``, reading it only if it isn't known by its metadata."""
+    metadata = _read_metadata(path)
+    if metadata.get('sha256') is None:
+        metadata['sha256'] = _hash_file(path).hexdigest()
+        _write_metadata(path, sha256=metadata['sha256'])
+    return metadata['sha256']
+
+
+def _hash_file(path):
+    hasher = hashlib.sha256()
     with open(path, 'rb') as file:
-        for chunk in iter(lambda: file.read(4096), b''):
-            hash_sha256.update(chunk)
-    return hash_sha256.hexdigest() == sha256
+        # Large buffers let hashlib release the GIL, so files can be hashed by multiple threads at the same time
+        for chunk in iter(lambda: file.read(_HASH_BUFFER_SIZE), b''):
+            hasher.update(chunk)
+    return hasher
+
+
+def _hash_tree(path):
+    """Return the SHA256 of the file or directory pointed to by ``path``, covering the names, content and permissions of all the files it contains."""
+    if not os.path.isdir(path):
+        return _hash_file(path).hexdigest()
+
+    hasher = hashlib.sha256()
+    for (root, dirs, files) in os.walk(path):
+        dirs.sort()
+        for name in sorted(files + [name for name in dirs if os.path.islink(os.path.join(root, name))]):
+            file_path = os.path.join(root, name)
+            hasher.update(os.path.relpath(file_path, path).encode() + b'\0')
+            hasher.update(oct(os.lstat(file_path).st_mode).encode() + b'\0')
+            if os.path.islink(file_path):
+                hasher.update(os.readlink(file_path).encode())
+            else:
+                hasher.update(_hash_file(file_path).digest())
+    return hasher.hexdigest()
+
+
+def _read_metadata(path):
+    """Read the metadata stored next to the downloaded file pointed to by ``path``.
+
+    The metadata are discarded if the file was modified since they were written.
+
+    :returns: A dictionary holding the metadata, which is empty if there is none or if they are outdated.
+    """
+    try:
+        metadata = toml.load(f'{path}.meta')
+        stat = os.stat(path)
+    except (OSError, toml.TomlDecodeError):
+        return dict()
+
+    if metadata.get('size') != stat.st_size or metadata.get('mtime') != stat.st_mtime_ns:
+        return dict()
+    return metadata
+
+
+def _write_metadata(path, **values):
+    """Update the metadata stored next to the downloaded file pointed to by ``path`` with ``values``.
+
+    The size and modification time of the file are stored alongside, to detect when the metadata become outdated.
+    """
+    metadata = _read_metadata(path)
+    metadata.update(values)
+
+    stat = os.stat(path)
+    metadata['size'] = stat.st_size
+    metadata['mtime'] = stat.st_mtime_ns
+
+    tmp_path = f'{path}.meta.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'w') as file:
+        toml.dump(metadata, file)
+    os.replace(tmp_path, f'{path}.meta')
@@ -5,22 +5,74 @@ Functions to write and manipulate logs.
 """
 
 import enum
+import threading
 import termcolor
+from typing import List, Optional
 from contextlib import contextmanager
 
-log_tab_level = 0
+log_tab_levels = threading.local()
+log_buffers = threading.local()
 
 
 @contextmanager
 def pushlog():
-    """Increase the log indentation level by one, making every new line indented by one extra tabulation."""
-    global log_tab_level
-    log_tab_level += 1
+    """Increase the log indentation level of the current thread by one, making every new line indented by one extra tabulation."""
+    with indentlog(get_log_level() + 1):
+        yield
+
+
+@contextmanager
+def indentlog(level: int):
+    """Set the log indentation level of the current thread to ``level`` for the duration of the new context.
 
+    :info: This is used by the threads working for another one, so their logs are indented like the ones of that thread (see
+        :py:func:`.get_log_level`).
+    :param level: The new indentation level.
+    """
+    old_level = get_log_level()
+    log_tab_levels.level = level
     try:
         yield
     finally:
-        log_tab_level -= 1
+        log_tab_levels.level = old_level
+
+
+def get_log_level() -> int:
+    """Return the log indentation level of the current thread."""
+    return getattr(log_tab_levels, 'level', 0)
+
+
+@contextmanager
+def bufferlog(lines: List[str] = None):
+    """Hold back every log printed by the current thread for the duration of the new context.
+
+    The held back lines are not printed. Instead, they are appended to the list yielded by this context manager,
+    so the caller can print them later, at a more appropriate time, using :py:func:`.flushlog`.
+
+    :info: This is used to keep the output deterministic when multiple threads are logging at the same time.
+    :param lines: If not ``None``, the list the lines are appended to, instead of a new one. This is useful to forward the logs of a thread
+        to the buffer of another one (see :py:func:`.get_log_buffer`).
+    """
+    old_buffer = getattr(log_buffers, 'lines', None)
+    log_buffers.lines = lines if lines is not None else []
+    try:
+        yield log_buffers.lines
+    finally:
+        log_buffers.lines = old_buffer
+
+
+def get_log_buffer() -> Optional[List[str]]:
+    """Return the list the logs of the current thread are held back in by :py:func:`.bufferlog`, or ``None`` if they are printed right away."""
+    return getattr(log_buffers, 'lines', None)
+
+
+def flushlog(lines: List[str]):
+    """Print the lines previously held back by :py:func:`.bufferlog`.
+
+    :param lines: The lines to print.
+    """
+    for line in lines:
+        _print(line)
 
 
 def dlog(*logs: str):
@@ -28,10 +80,8 @@ def dlog(*logs: str):
 
     :param logs: The content of the log.
     """
-    global log_tab_level
-
-    indent = '    ' * log_tab_level
-    print(f"{termcolor.colored('[d]', 'magenta', attrs=['bold'])} {indent}", *logs, flush=True)
+    indent = '    ' * get_log_level()
+    _print(f"{termcolor.colored('[d]', 'magenta', attrs=['bold'])} {indent}", *logs)
 
 
 def ilog(*logs: str):
@@ -39,10 +89,8 @@ def ilog(*logs: str):
 
     :param logs: The content of the log.
     """
-    global log_tab_level
-
-    indent = '    ' * log_tab_level
-    print(f"{termcolor.colored('[*]', 'blue', attrs=['bold'])} {indent}", *logs, flush=True)
+    indent = '    ' * get_log_level()
+    _print(f"{termcolor.colored('[*]', 'blue', attrs=['bold'])} {indent}", *logs)
 
 
 def slog(*logs: str):
@@ -50,10 +98,8 @@ def slog(*logs: str):
 
     :param logs: The content of the log.
     """
-    global log_tab_level
-
-    indent = '    ' * log_tab_level
-    print(f"{termcolor.colored('[+]', 'green', attrs=['bold'])} {indent}", *logs, flush=True)
+    indent = '    ' * get_log_level()
+    _print(f"{termcolor.colored('[+]', 'green', attrs=['bold'])} {indent}", *logs)
 
 
 def wlog(*logs: str):
@@ -61,10 +107,8 @@ def wlog(*logs: str):
 
     :param logs: The content of the log.
     """
-    global log_tab_level
-
-    indent = '    ' * log_tab_level
-    print(f"{termcolor.colored('[!]', 'yellow', attrs=['bold'])} {indent}", *logs, flush=True)
+    indent = '    ' * get_log_level()
+    _print(f"{termcolor.colored('[!]', 'yellow', attrs=['bold'])} {indent}", *logs)
 
 
 def elog(*logs: str):
@@ -72,10 +116,8 @@ def elog(*logs: str):
 
     :param logs: The content of the log.
     """
-    global log_tab_level
-
-    indent = '    ' * log_tab_level
-    print(f"{termcolor.colored('[-]', 'red', attrs=['bold'])} {indent}", *logs, flush=True)
+    indent = '    ' * get_log_level()
+    _print(f"{termcolor.colored('[-]', 'red', attrs=['bold'])} {indent}", *logs)
 
 
 def flog(*logs: str):
@@ -84,4 +126,12 @@ def flog(*logs: str):
     :info: This function does NOT abort the current process's execution.
     :param logs: The content of the log.
     """
-    termcolor.cprint(f"[-]  {' '.join(logs)}", 'red', attrs=['bold'])
+    _print(termcolor.colored(f"[-]  {' '.join(logs)}", 'red', attrs=['bold']))
+
+
+def _print(*values: str):
+    lines = get_log_buffer()
+    if lines is not None:
+        lines.append(' '.join(map(str, values)))
+    else:
+        print(*values, flush=True)
@@ -32,8 +32,12 @@ import os
 import textwrap
 import core
 import stdlib.log
+import stdlib.patch
+import stdlib.usage
 from typing import List, Dict
 
+_prefetched_manifests = []
+
 
 class BuildManifestMetadata():
     """A set of values used as a reference when filling the metadata of the built packages
@@ -214,6 +218,12 @@ def manifest(
         for the exact meaning and limitation of ``kwargs`` and ``versions_data``.
     :info: The packages ``stable::raven-os/essentials`` and ``stable::raven-os/essentials-dev`` are guaranteed to be installed.
         There is no need to include them in ``build_dependencies``.
+    :info: With ``--prefetch``, nothing is installed nor built: the :py:class:`.BuildManifest` is only registered so
+        its inputs can be downloaded by :py:func:`stdlib.fetch.prefetch`.
+    :info: With ``--check-patches``, nothing is installed nor built either: the builds are only executed until their patches are
+        applied (see :py:func:`stdlib.patch.check_builds`).
+    :info: Once the packages of a build are wrapped, the resources used by its commands are reported next to them
+        (see :py:func:`stdlib.usage.write_report`).
 
     :param kwargs: Arguments transferred to the constructor of :py:class:`.BuildManifestMetadata`
     :param versions_data: Versionized arguments of the build manifest.
@@ -228,6 +238,14 @@ def manifest(
             builder,
         )
 
+        if core.args.get_args().prefetch:
+            _prefetched_manifests.append(manifest)
+            return
+
+        if core.args.get_args().check_patches:
+            stdlib.patch.check_builds(manifest.builds())
+            return
+
         # Install build dependencies
         if len(build_dependencies) > 0:
             stdlib.log.slog("installing build dependencies...")
@@ -273,6 +291,14 @@ def manifest(
                     with stdlib.log.pushlog():
                         pkg.wrap()
 
+                report_path = stdlib.usage.write_report(build)
+                stdlib.log.slog(f"Resource usage report written to {report_path}")
+
             stdlib.log.slog(f"Done!")
 
     return exec_manifest
+
+
+def prefetched_manifests() -> List[BuildManifest]:
+    """Return the build manifests registered by :py:func:`.manifest` when running with ``--prefetch``, in the order they were loaded."""
+    return _prefetched_manifests
@@ -1,10 +1,37 @@
 #!/usr/bin/env python3.6
 # -*- coding: utf-8 -*-
-"""Provides functions to apply patches to a code base."""
+"""Provides functions to apply patches to a code base.
+
+Patches are usually applied as a series, with :py:func:`.patch_all`. The order of the series is given by a series file, in the
+format used by ``quilt``: one patch per line, optionally followed by the ``-pN`` option of the GNU ``patch`` utility. Blank lines
+and lines starting with ``#`` are ignored. The paths of the patches are relative to the directory of the series file::
+
+    # Backported from upstream
+    0001-fix-build-with-gcc-9.patch
+    0002-use-system-zlib.patch -p0
+
+The result of applying a series (which patch failed, if any) is recorded in the patch cache (see
+:py:func:`~core.cache.get_patch_cache`), under a key made of the inputs of the build (see :py:attr:`.Build.fetched`), the directory
+the series is applied in and the content of the patches. With ``--check-patches``, a recorded result is reused instead of applying
+the same series on the same source code again.
+"""
 
 import os
-import stdlib
 import glob
+import shlex
+import hashlib
+import tempfile
+import traceback
+import toml
+import core.args
+import stdlib
+import stdlib.log
+from core.cache import get_patch_cache
+from multiprocessing import cpu_count
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+_checked_builds = []
 
 
 def patch(
@@ -21,12 +48,202 @@ def patch(
     stdlib.log.slog(f"Applied patch {os.path.basename(path)}")
 
 
-def patch_all():
+def patch_all(
+    series: str = 'series',
+):
     """Apply all patches of the current directory on the code base.
 
+    If the series file pointed to by ``series`` exists, the patches it lists are applied in this order. Otherwise, all the ``.patch``
+    files of the current directory are applied in alphabetical order.
+
+    All the patches are applied by a single shell, and the result is recorded in the patch cache.
+
+    With ``--check-patches``, the build stops once the patches are applied: the execution of the build manifest is ended with a
+    status of ``0`` if they all applied cleanly, ``1`` otherwise.
+
     :note: All patches must be a compatible input for the GNU ``patch`` utility.
-    :note: The patches must be ``.patch`` files to be automatically picked up by this function.
+    :note: Without a series file, the patches must be ``.patch`` files to be automatically picked up by this function.
+
+    :param series: The path pointing to the series file. It must be relative to the current directory. The default value is ``series``.
     """
+    if os.path.exists(series):
+        patches = _read_series(series)
+    else:
+        patches = [(path, 1) for path in sorted(glob.glob('*.patch'))]
+
+    checking = core.args.get_args().check_patches
+    record_path = _get_record_path(patches)
+
+    recorded = checking and os.path.exists(record_path)
+    if recorded:
+        failed = toml.load(record_path).get('failed')
+        stdlib.log.ilog("The result of applying this series was recorded in a previous run")
+    elif len(patches) > 0:
+        failed = _apply_series(patches)
+
+        os.makedirs(os.path.dirname(record_path), exist_ok=True)
+        with open(f'{record_path}.tmp', 'w') as file:
+            toml.dump({'patches': [path for (path, _) in patches], 'failed': failed or ''}, file)
+        os.replace(f'{record_path}.tmp', record_path)
+    else:
+        failed = None
+
+    if failed:
+        stdlib.log.flog(f"Failed to apply patch {os.path.basename(failed)}{' (recorded in a previous run)' if recorded else ''}")
+        exit(1)
+
+    for (path, _) in patches:
+        if recorded:
+            stdlib.log.slog(f"Patch {os.path.basename(path)} applied cleanly in a previous run")
+        else:
+            stdlib.log.slog(f"Applied patch {os.path.basename(path)}")
+
+    if checking:
+        exit(0)
+
+
+def check_builds(
+    builds,
+    jobs: int = None,
+):
+    """Execute ``builds`` until their patches are applied by :py:func:`.patch_all`, in parallel, and report the versions they
+    don't apply cleanly on.
+
+    This is used by ``--check-patches``, to refresh the patches of a build manifest for a new upstream version without building it.
+    The execution of the build manifest is aborted if the patches of any build didn't apply cleanly.
+
+    :note: Builds are executed in forked processes, until :py:func:`.patch_all` ends them. A build that never calls it is executed
+        entirely and reported as failed, like a build that raises an exception. The processes are forked before any build is
+        executed, so no thread of :py:mod:`stdlib.fetch` or :py:mod:`stdlib.extract` is running yet.
+
+    :param builds: The builds to check.
+    :type builds: ``List`` [ :py:class:`.Build` ]
+    :param jobs: The maximum number of builds executed at the same time. The default value is the number of CPUs.
+    """
+    global _checked_builds
+
+    # Builds are inherited by the forked workers, as build manifests can't be pickled
+    _checked_builds = builds
+
+    stdlib.log.slog(f"Checking the patches of {len(builds)} version(s)")
+    with ProcessPoolExecutor(jobs or cpu_count()) as executor:
+        results = list(executor.map(_check_build, range(len(builds))))
+
+    failures = list()
+    for (build, (lines, code)) in zip(builds, results):
+        stdlib.log.ilog(f"Checking {build}")
+        stdlib.log.flushlog(lines)
+        if code != 0:
+            failures.append(build)
+
+    if len(failures) > 0:
+        stdlib.log.flog(f"The patches don't apply cleanly on: {', '.join(map(str, failures))}")
+        exit(1)
+
+    stdlib.log.slog("All the patches apply cleanly!")
+
+
+def _check_build(index):
+    build = _checked_builds[index]
+
+    with stdlib.log.bufferlog() as lines:
+        with stdlib.log.pushlog():
+            try:
+                with stdlib.pushd(), stdlib.pushenv():
+                    build.build()
+                stdlib.log.elog("The build never called patch_all()")
+                code = 1
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else 1
+            except Exception:
+                # The other builds are still checked, and their logs printed
+                stdlib.log.elog("The build raised an exception:")
+                with stdlib.log.pushlog():
+                    for line in traceback.format_exc().splitlines():
+                        stdlib.log.elog(line)
+                code = 1
+    return (lines, code)
+
+
+def _read_series(series) -> List[Tuple[str, int]]:
+    """Return the patches listed in the series file pointed to by ``series``, with their strip level."""
+    patches = list()
+
+    with open(series) as file:
+        for (number, line) in enumerate(file, start=1):
+            words = line.split('#', 1)[0].split()
+            if len(words) == 0:
+                continue
+
+            path = os.path.join(os.path.dirname(series), words[0])
+            level = 1
+            for option in words[1:]:
+                if option.startswith('-p') and option[2:].isdigit():
+                    level = int(option[2:])
+                else:
+                    stdlib.log.flog(f"{series}:{number}: Unsupported option {option}")
+                    exit(1)
+            patches.append((path, level))
+    return patches
+
+
+def _apply_series(patches):
+    """Apply ``patches`` in a single shell, and return the path of the patch that failed, or ``None``.
+
+    The output of ``patch`` for the patch that failed (like the hunks that were rejected) is logged as an error.
+    """
+    (fd, progress_path) = tempfile.mkstemp(prefix='nbuild-patch-')
+    os.close(fd)
+    (fd, output_path) = tempfile.mkstemp(prefix='nbuild-patch-')
+    os.close(fd)
+
+    try:
+        # The output of each patch is kept until the next one, to be logged if it fails
+        script = '\n'.join(
+            f'patch -Np{level} -i {shlex.quote(path)} > {shlex.quote(output_path)} 2>&1 || {{ cat {shlex.quote(output_path)}; exit 1; }}\n'
+            f'cat {shlex.quote(output_path)}\n'
+            f'echo >> {shlex.quote(progress_path)}'
+            for (path, level) in patches
+        )
+        code = stdlib.cmd(script, fail_ok=True)
+
+        if code == 0:
+            return None
+
+        # One line is written in the progress file per applied patch
+        with open(progress_path) as file:
+            failed = patches[min(len(file.readlines()), len(patches) - 1)][0]
+
+        with open(output_path, errors='replace') as file:
+            output = file.read().splitlines()
+
+        stdlib.log.elog(f"Output of patch for {os.path.basename(failed)}:")
+        with stdlib.log.pushlog():
+            for line in output:
+                stdlib.log.elog(line)
+        return failed
+    finally:
+        os.remove(progress_path)
+        os.remove(output_path)
+
+
+def _get_record_path(patches):
+    build = stdlib.build.current_build()
+    hasher = hashlib.sha256()
+
+    if build is not None:
+        for (kind, name, digest) in build.fetched:
+            hasher.update(f'{kind}\0{name}\0{digest}\0'.encode())
+        hasher.update(repr(sorted(build.extract_filters.items())).encode())
+        hasher.update(os.path.relpath(os.getcwd(), build.build_cache).encode() + b'\0')
+
+    for (path, level) in patches:
+        hasher.update(f'{os.path.basename(path)}\0{level}\0'.encode())
+        try:
+            with open(path, 'rb') as file:
+                hasher.update(hashlib.sha256(file.read()).digest())
+        except OSError as e:
+            stdlib.log.flog(f"Failed to read patch {os.path.basename(path)}: {e.strerror} ({path})")
+            exit(1)
 
-    for patch_path in glob.glob('*.patch'):
-        patch(patch_path)
+    return os.path.join(get_patch_cache(), f'{hasher.hexdigest()}.toml')
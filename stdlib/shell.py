@@ -0,0 +1,221 @@
+#!/usr/bin/env python3.6
+# -*- coding: utf-8 -*-
+"""Provides a persistent shell, executing the commands of :py:func:`~stdlib.cmd.cmd` without starting a new ``bash`` each time.
+
+It is enabled with ``persistent = true`` in the ``[shell]`` section of the configuration file. A single ``bash`` process is then
+started per build, and each command is sent to it through a pipe. The command is executed in a subshell (a fork of ``bash``, not a new
+program), in the working directory and environment ``nbuild`` has when the command is executed: they are synchronised before each
+command, so :py:func:`~stdlib.pushd.pushd` and :py:func:`~stdlib.pushenv.pushenv` work as usual, and a command can't change the
+working directory or the environment of the next one.
+
+The standard output and error of each command are written to two named pipes created for it, so they are kept apart as with a new
+``bash``, and its end is marked by a line made of a random token and its exit code, written by the shell to its own standard output.
+The shell is started again after a command fails, in case the failure left it in a bad state.
+
+:note: Like with a new ``bash``, the processes a command leaves in the background can't write to its output once it finished: its named
+    pipes are removed and closed, so they get ``SIGPIPE``. Their output can be redirected to a file instead.
+
+:note: The resources used by the commands are only partially known: the CPU times are read from the shell, but its children's peak
+    RSS, block I/O and context switches aren't available.
+"""
+
+import os
+import re
+import shlex
+import shutil
+import secrets
+import tempfile
+import subprocess
+import threading
+import core.config
+import stdlib.build
+import stdlib.usage
+from typing import Optional, Tuple
+
+# Environment variables with another name can't be set by bash
+_VARIABLE_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+_shell = None
+
+
+class Shell():
+    """A ``bash`` process executing commands one after the other, for the build ``build``.
+
+    :param build: The build the shell is started for.
+    :type build: :py:class:`.Build`
+    """
+    def __init__(
+        self,
+        build,
+    ):
+        self.build = build
+        self.pid = os.getpid()
+        self.token = f'nbuild-{secrets.token_hex(16)}'.encode()
+
+        # The commands read the standard input of nbuild, through another file descriptor, as the one of the shell is a pipe
+        try:
+            self.stdin_fd = os.dup(0)
+        except OSError:
+            self.stdin_fd = os.open(os.devnull, os.O_RDONLY)
+
+        self.env = dict(os.environ)
+        self.process = subprocess.Popen(
+            ['bash', '--noprofile', '--norc'],
+            env=self.env,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            pass_fds=(self.stdin_fd,),
+        )
+        os.close(self.stdin_fd)
+
+        self.code = None
+        self.times = None
+        self.fifos_path = None
+        self.fifo_fds = list()
+
+    def is_usable(self) -> bool:
+        """Test whether the shell can execute the next command of the current build, in the current process."""
+        return (
+            self.process.poll() is None
+            and self.pid == os.getpid()
+            and self.build is stdlib.build.current_build()
+        )
+
+    def send(
+        self,
+        cmd: str,
+    ) -> Tuple[int, int]:
+        """Send ``cmd`` to the shell, to execute it in the current working directory with the current environment.
+
+        Its output must then be read from the returned file descriptors until :py:meth:`.fileno` is readable, and its exit code with
+        :py:meth:`.wait`.
+
+        :param cmd: The shell command to execute.
+        :returns: The file descriptors to read the standard output and error of the command from.
+        """
+        self.fifos_path = tempfile.mkdtemp(prefix='nbuild-shell-')
+        paths = [os.path.join(self.fifos_path, name) for name in ('stdout', 'stderr')]
+        for path in paths:
+            os.mkfifo(path, 0o600)
+
+            # Opening the named pipe for reading doesn't wait for the shell to open it, and keeping it open for writing until the
+            # command finished means nothing is mistaken for its end before that
+            fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+            os.set_blocking(fd, True)
+            self.fifo_fds += [fd, os.open(path, os.O_WRONLY)]
+
+        script = self._sync_env()
+        # The redirections are made by the subshell with exec, as the ones of a compound command would leave copies of the file
+        # descriptors of the shell to the processes the command starts in the background
+        script += f'( exec >{shlex.quote(paths[0])} 2>{shlex.quote(paths[1])} 0<&{self.stdin_fd} {self.stdin_fd}<&-; '
+        script += f'cd -- {shlex.quote(os.getcwd())} || exit; set -e; eval {shlex.quote(cmd)} )\n'
+        script += f'printf "%s %d\\n" {self.token.decode()} "$?"\n'
+
+        self.code = None
+        self.times = self._read_times()
+        self.process.stdin.write(script.encode())
+        self.process.stdin.flush()
+        return (self.fifo_fds[0], self.fifo_fds[2])
+
+    def fileno(self) -> int:
+        """Return the file descriptor which is readable once the command finished (or the shell exited)."""
+        return self.process.stdout.fileno()
+
+    def wait(self) -> Tuple[int, 'stdlib.usage.Usage']:
+        """Return the exit code of the command and the CPU time it used, once :py:meth:`.fileno` is readable, and remove its named pipes.
+
+        :returns: The exit code of the command, and the resources it used.
+        """
+        line = self.process.stdout.readline()
+        if line.startswith(self.token + b' '):
+            self.code = int(line.split()[1])
+        else:
+            # The shell exited, like when it is killed
+            self.code = self.process.wait() or 1
+        self._remove_fifos()
+
+        usage = stdlib.usage.Usage()
+        usage.commands = 1
+
+        times = self._read_times()
+        if self.times is not None and times is not None:
+            (usage.user_time, usage.system_time) = (times[0] - self.times[0], times[1] - self.times[1])
+
+        return (self.code, usage)
+
+    def close(self):
+        """Stop the shell, by closing its standard input."""
+        if self.pid == os.getpid():
+            self.process.stdin.close()
+            self.process.wait()
+            self.process.stdout.close()
+            self._remove_fifos()
+
+    def _remove_fifos(self):
+        """Close and remove the named pipes of the last command, if any."""
+        for fd in self.fifo_fds:
+            os.close(fd)
+        self.fifo_fds = list()
+
+        if self.fifos_path is not None:
+            shutil.rmtree(self.fifos_path, ignore_errors=True)
+            self.fifos_path = None
+
+    def _sync_env(self):
+        """Return the commands updating the environment of the shell to match the current one."""
+        env = {key: value for (key, value) in os.environ.items() if _VARIABLE_NAME.match(key)}
+        script = ''
+
+        removed = [key for key in self.env if key not in env and _VARIABLE_NAME.match(key)]
+        if len(removed) > 0:
+            script += f'unset -v {" ".join(removed)}\n'
+
+        for (key, value) in env.items():
+            if self.env.get(key) != value:
+                script += f'export {key}={shlex.quote(value)}\n'
+
+        self.env = env
+        return script
+
+    def _read_times(self) -> Optional[Tuple[float, float]]:
+        """Return the user and system CPU time used by the children of the shell it waited for, or ``None`` if it isn't known."""
+        try:
+            with open(f'/proc/{self.process.pid}/stat') as file:
+                fields = file.read().rsplit(')', 1)[1].split()
+        except OSError:
+            return None
+
+        # The fields cutime and cstime (16 and 17 in proc(5)), in clock ticks
+        ticks = os.sysconf('SC_CLK_TCK')
+        return (int(fields[13]) / ticks, int(fields[14]) / ticks)
+
+
+def get_shell() -> Optional[Shell]:
+    """Return the persistent shell of the current build, starting it if needed, or ``None`` if it can't be used.
+
+    The persistent shell is only used when it is enabled in the configuration file, for the commands executed by the main thread
+    during a build.
+    """
+    global _shell
+
+    if not _is_enabled() or stdlib.build.current_build() is None or threading.current_thread() is not threading.main_thread():
+        return None
+
+    if _shell is None or not _shell.is_usable():
+        if _shell is not None:
+            _shell.close()
+        _shell = Shell(stdlib.build.current_build())
+    return _shell
+
+
+def restart_shell():
+    """Stop the persistent shell, so the next command starts a new one."""
+    global _shell
+
+    if _shell is not None:
+        _shell.close()
+        _shell = None
+
+
+def _is_enabled():
+    return (core.config.get_config() or {}).get('shell', {}).get('persistent', False)
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3.6
+# -*- coding: utf-8 -*-
+"""Provides functions to cache the source code of a build once it is prepared (extracted and patched), and restore it later.
+
+A snapshot is an uncompressed tarball of the build cache, taken once the source code is prepared. It is stored in the snapshot
+cache (see :py:func:`~core.cache.get_snapshot_cache`) under a key made of:
+
+  * The content of the inputs fetched by the functions of :py:mod:`stdlib.fetch` (see :py:attr:`.Build.fetched`), and the filters
+    to extract them with (see :py:attr:`.Build.extract_filters`)
+  * The functions used to prepare the source code (like the ``extract`` and ``patch`` steps of the templates), including
+    their source code and the values they captured
+  * The source code of :py:mod:`stdlib.extract` and :py:mod:`stdlib.patch`
+
+When a build with the same key is executed again, for example after changing the options given to ``configure``, the snapshot
+is restored instead of extracting and patching the source code again.
+
+Snapshots are disabled unless ``enabled`` is ``true`` in the ``[snapshot]`` section of the configuration file.
+"""
+
+import os
+import shutil
+import hashlib
+import inspect
+import tarfile
+import functools
+import enum
+import core.args
+import core.config
+import stdlib
+import stdlib.build
+import stdlib.extract
+import stdlib.patch
+import stdlib.usage
+from core.cache import get_snapshot_cache
+
+# Changing the way snapshots are taken or restored invalidates the existing ones
+_SNAPSHOT_FORMAT = '2'
+
+
+class _UnstableValueError(Exception):
+    """Raised by :py:func:`._describe` for a value that has no description stable from one run to the other."""
+    pass
+
+
+def prepare(
+    extract,
+    patch,
+    nb_steps: int,
+):
+    """Execute the extract and patch steps of a template (its steps 2 and 3), unless the source code they prepared in a previous
+    run, with the same inputs and the same functions, can be restored from a snapshot instead.
+
+    A snapshot is taken once the steps are executed, for the next runs.
+
+    :param extract: The function executing the extract step, or ``None`` to skip it.
+    :param patch: The function executing the patch step, or ``None`` to skip it.
+    :param nb_steps: The total number of steps of the template, to log the progression.
+    """
+    with stdlib.log.pushlog():
+        restored = restore(extract, patch)
+
+    stdlib.log.ilog(f"Step 2/{nb_steps}: Extract")
+    if extract is not None and not restored:
+        with stdlib.log.pushlog(), stdlib.usage.step('extract'):
+            extract()
+
+    stdlib.log.ilog(f"Step 3/{nb_steps}: Patch")
+    if patch is not None and not restored:
+        with stdlib.log.pushlog(), stdlib.usage.step('patch'):
+            patch()
+
+    if not restored:
+        with stdlib.log.pushlog():
+            save(extract, patch)
+
+
+def restore(*steps) -> bool:
+    """Restore the snapshot of the current build taken after calling ``steps``, if any.
+
+    Everything in the build cache but the files and directories fetched by :py:func:`~stdlib.fetch.fetch_url` and
+    :py:func:`~stdlib.fetch.fetch_file` is replaced by the content of the snapshot.
+
+    :note: Only the source code and the captured values of the functions in ``steps`` are part of the key of the snapshot, not
+        the global variables or the other functions they use. If these change, the snapshot cache must be purged.
+
+    :param steps: The functions used to prepare the source code, in the same order as for :py:func:`.save`. ``None`` may be given
+        for a step that is skipped.
+    :returns: ``True`` if a snapshot was restored, ``False`` if there is none, if snapshots are disabled or if ``steps`` can't be
+        part of the key of a snapshot.
+    """
+    if not is_enabled():
+        return False
+
+    build = stdlib.build.current_build()
+    try:
+        snapshot_path = _get_snapshot_path(build, steps)
+    except _UnstableValueError as e:
+        stdlib.log.wlog(f"No snapshot of the prepared source code can be used, as {e} changes from one run to the other")
+        return False
+
+    if not os.path.exists(snapshot_path):
+        stdlib.log.ilog("No snapshot of the prepared source code, preparing it...")
+        return False
+
+    stdlib.log.slog("Restoring the snapshot of the prepared source code")
+
+    fetched = _get_fetched_entries(build)
+    for name in os.listdir(build.build_cache):
+        if name not in fetched:
+            path = os.path.join(build.build_cache, name)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
+    with tarfile.open(snapshot_path, mode='r') as tar:
+        tar.extractall(build.build_cache)
+    return True
+
+
+def save(*steps):
+    """Take a snapshot of the current build, whose source code was just prepared by calling ``steps``.
+
+    Everything in the build cache but the files and directories fetched by :py:func:`~stdlib.fetch.fetch_url` and
+    :py:func:`~stdlib.fetch.fetch_file` (which are fetched anyway) is stored in the snapshot. Previous snapshots of the same
+    build are removed.
+
+    :param steps: The functions used to prepare the source code. ``None`` may be given for a step that was skipped.
+    """
+    if not is_enabled():
+        return
+
+    build = stdlib.build.current_build()
+    try:
+        snapshot_path = _get_snapshot_path(build, steps)
+    except _UnstableValueError:
+        return  # Already reported by restore()
+    snapshot_cache = os.path.dirname(snapshot_path)
+    fetched = _get_fetched_entries(build)
+
+    stdlib.log.ilog("Taking a snapshot of the prepared source code...")
+
+    os.makedirs(snapshot_cache, exist_ok=True)
+    for name in os.listdir(snapshot_cache):
+        os.remove(os.path.join(snapshot_cache, name))
+
+    tmp_path = f'{snapshot_path}.tmp'
+    with tarfile.open(tmp_path, mode='w', format=tarfile.PAX_FORMAT) as tar:
+        for name in sorted(os.listdir(build.build_cache)):
+            if name not in fetched:
+                tar.add(os.path.join(build.build_cache, name), arcname=name)
+    os.replace(tmp_path, snapshot_path)
+
+
+def is_enabled() -> bool:
+    """Test whether snapshots are enabled for the current run."""
+    # Checking the patches requires applying them
+    if core.args.get_args().check_patches:
+        return False
+    return (core.config.get_config() or {}).get('snapshot', {}).get('enabled', False)
+
+
+def _get_fetched_entries(build):
+    """Return the names of the entries of the build cache fetched by ``fetch_url()`` and ``fetch_file()``."""
+    return set(name for (kind, name, _) in build.fetched if kind != 'git')
+
+
+def _get_snapshot_path(build, steps):
+    hasher = hashlib.sha256()
+    hasher.update(_SNAPSHOT_FORMAT.encode())
+
+    for (kind, name, digest) in build.fetched:
+        hasher.update(f'{kind}\0{name}\0{digest}\0'.encode())
+    hasher.update(_describe(build.extract_filters).encode())
+
+    for step in steps:
+        hasher.update(_describe(step).encode() + b'\0')
+
+    for module in [stdlib.extract, stdlib.patch]:
+        hasher.update(inspect.getsource(module).encode())
+
+    return os.path.join(
+        get_snapshot_cache(build),
+        f'{hasher.hexdigest()}.tar',
+    )
+
+
+def _describe(value, seen=frozenset()):
+    """Return a string describing ``value``, that only changes if the behaviour of ``value`` may change.
+
+    Functions are described by their name, source code, default arguments and captured values, and builds by their name and
+    version, instead of their address.
+
+    :raises _UnstableValueError: If ``value`` (or a value it contains) has no such description, like an object whose representation
+        is its address.
+    """
+    if id(value) in seen:
+        return '...'  # A recursive function captures itself
+    seen = seen | {id(value)}
+
+    if isinstance(value, functools.partial):
+        return f'partial({_describe(value.func, seen)}, {_describe(value.args, seen)}, {_describe(value.keywords, seen)})'
+    elif isinstance(value, (list, tuple)):
+        return f'({", ".join(_describe(item, seen) for item in value)})'
+    elif isinstance(value, (set, frozenset)):
+        return f'{{{", ".join(sorted(_describe(item, seen) for item in value))}}}'
+    elif isinstance(value, dict):
+        items = sorted(value.items(), key=lambda item: repr(item[0]))
+        return f'{{{", ".join(f"{_describe(key, seen)}: {_describe(item, seen)}" for (key, item) in items)}}}'
+    elif inspect.isfunction(value) or inspect.ismethod(value):
+        try:
+            source = inspect.getsource(value)
+        except (OSError, TypeError):
+            source = ''
+
+        if inspect.ismethod(value):
+            # The object the method is bound to is described like a captured value
+            closure = [value.__self__]
+        else:
+            closure = [cell.cell_contents for cell in (value.__closure__ or [])]
+        return (
+            f'{value.__module__}.{value.__qualname__}({source}, {_describe(value.__defaults__ or (), seen)}, '
+            f'{_describe(value.__kwdefaults__ or {}, seen)}, {_describe(closure, seen)})'
+        )
+    elif inspect.isclass(value) or (inspect.isbuiltin(value) and (value.__self__ is None or inspect.ismodule(value.__self__))):
+        return f'{value.__module__}.{value.__qualname__}'
+    elif isinstance(value, stdlib.build.Build):
+        return f'Build({value.manifest.metadata.category}/{value.manifest.metadata.name}, {value.semver})'
+    elif value is None or isinstance(value, (bool, int, float, str, bytes, enum.Enum)):
+        return repr(value)
+    raise _UnstableValueError(f"{type(value).__name__} {value!r}")
@@ -8,6 +8,8 @@ import stdlib
 import stdlib.fetch
 import stdlib.extract
 import stdlib.patch
+import stdlib.snapshot
+import stdlib.usage
 import stdlib.split.system
 import stdlib.deplinker.elf
 
@@ -56,6 +58,9 @@ def build(
 
         This step is used to patch the downloaded source code. The default value is :py:func:`.patch_all` with no argument.
 
+        The extract and patch steps are skipped if the source code they prepared can be restored from a snapshot instead
+        (see :py:func:`stdlib.snapshot.prepare`).
+
     From now on, the current working directory is changed in favor of ``build_folder`` (which defaults to ``.``).
     If the directory pointed by ``build_folder`` doesn't exist, it is created.
 
@@ -99,18 +104,10 @@ def build(
 
     stdlib.log.ilog("Step 1/9: Fetch")
     if fetch is not None:
-        with stdlib.log.pushlog():
+        with stdlib.log.pushlog(), stdlib.usage.step('fetch'):
             fetch()
 
-    stdlib.log.ilog("Step 2/9: Extract")
-    if extract is not None:
-        with stdlib.log.pushlog():
-            extract()
-
-    stdlib.log.ilog("Step 3/9: Patch")
-    if patch is not None:
-        with stdlib.log.pushlog():
-            patch()
+    stdlib.snapshot.prepare(extract, patch, 9)
 
     packages = dict()
 
@@ -119,28 +116,28 @@ def build(
 
         stdlib.log.ilog("Step 4/9: Configure")
         if configure is not None:
-            with stdlib.log.pushlog():
+            with stdlib.log.pushlog(), stdlib.usage.step('configure'):
                 configure()
 
         stdlib.log.ilog("Step 5/9: Compile")
         if compile is not None:
-            with stdlib.log.pushlog():
+            with stdlib.log.pushlog(), stdlib.usage.step('compile'):
                 compile()
 
         stdlib.log.ilog("Step 6/9: Check")
         if check is not None:
-            with stdlib.log.pushlog():
+            with stdlib.log.pushlog(), stdlib.usage.step('check'):
                 check()
 
         stdlib.log.ilog("Step 7/9: Install")
         if install is not None:
-            with stdlib.log.pushlog(), stdlib.pushenv():
+            with stdlib.log.pushlog(), stdlib.usage.step('install'), stdlib.pushenv():
                 os.environ['DESTDIR'] = build.install_cache
                 install()
 
         stdlib.log.ilog("Step 8/9: Split")
         if split is not None:
-            with stdlib.log.pushlog():
+            with stdlib.log.pushlog(), stdlib.usage.step('split'):
                 packages = split()
 
                 if len(packages) > 0:
@@ -152,7 +149,7 @@ def build(
 
         stdlib.log.ilog("Step 9/9: Dependency Linking")
         if deplinker is not None:
-            with stdlib.log.pushlog():
+            with stdlib.log.pushlog(), stdlib.usage.step('dependency_linking'):
                 deplinker(packages)
 
     return packages
@@ -199,6 +196,9 @@ def build_all(
 
         This step is used to patch the downloaded source code. The default value is :py:func:`.patch_all` with no argument.
 
+        The extract and patch steps are skipped if the source code they prepared can be restored from a snapshot instead
+        (see :py:func:`stdlib.snapshot.prepare`).
+
     From now on, the following four steps are repeated for each item in ``compilation``. Each item must be an object containing
     a ``clean_before``, ``configure``, ``compile``, ``check``, ``install`` and ``clean_after`` key where the value must be a function.
     If the key is not present, the default value is taken instead.
@@ -260,18 +260,10 @@ def build_all(
 
     stdlib.log.ilog(f"Step 1/{nb_steps}: Fetch")
     if fetch is not None:
-        with stdlib.log.pushlog():
+        with stdlib.log.pushlog(), stdlib.usage.step('fetch'):
             fetch()
 
-    stdlib.log.ilog(f"Step 2/{nb_steps}: Extract")
-    if extract is not None:
-        with stdlib.log.pushlog():
-            extract()
-
-    stdlib.log.ilog(f"Step 3/{nb_steps}: Patch")
-    if patch is not None:
-        with stdlib.log.pushlog():
-            patch()
+    stdlib.snapshot.prepare(extract, patch, nb_steps)
 
     packages = dict()
 
@@ -283,42 +275,42 @@ def build_all(
 
             stdlib.log.ilog(f"Step {relative_step + 1}/{nb_steps}: Clean before")
             if compilation.get('clean_before') is not None:
-                with stdlib.log.pushlog():
+                with stdlib.log.pushlog(), stdlib.usage.step('clean_before'):
                     compilation['clean_before']()
 
             stdlib.log.ilog(f"Step {relative_step + 2}/{nb_steps}: Configure")
             if compilation.get('configure') is None:
                 compilation['configure'] = configure
-            with stdlib.log.pushlog():
+            with stdlib.log.pushlog(), stdlib.usage.step('configure'):
                 compilation['configure']()
 
             stdlib.log.ilog(f"Step {relative_step + 3}/{nb_steps}: Compilation")
             if compilation.get('compile') is None:
                 compilation['compile'] = make
-            with stdlib.log.pushlog():
+            with stdlib.log.pushlog(), stdlib.usage.step('compile'):
                 compilation['compile']()
 
             stdlib.log.ilog(f"Step {relative_step + 4}/{nb_steps}: Check")
             if compilation.get('check') is None:
                 compilation['check'] = lambda: make('check', fail_ok=True)
-            with stdlib.log.pushlog():
+            with stdlib.log.pushlog(), stdlib.usage.step('check'):
                 compilation['check']()
 
             stdlib.log.ilog(f"Step {relative_step + 5}/{nb_steps}: Install")
             if compilation.get('install') is None:
                 compilation['install'] = lambda: make('install', f'DESTDIR={stdlib.build.current_build().install_cache}')
-            with stdlib.log.pushlog(), stdlib.pushenv():
+            with stdlib.log.pushlog(), stdlib.usage.step('install'), stdlib.pushenv():
                 os.environ['DESTDIR'] = build.install_cache
                 compilation['install']()
 
             stdlib.log.ilog(f"Step {relative_step + 6}/{nb_steps}: Clean after")
             if compilation.get('clean_after') is not None:
-                with stdlib.log.pushlog():
+                with stdlib.log.pushlog(), stdlib.usage.step('clean_after'):
                     compilation['clean_after']()
 
         stdlib.log.ilog(f"Step {nb_steps-1}/{nb_steps}: Split")
         if split is not None:
-            with stdlib.log.pushlog():
+            with stdlib.log.pushlog(), stdlib.usage.step('split'):
                 packages = split()
 
                 if len(packages) > 0:
@@ -330,7 +322,7 @@ def build_all(
 
         stdlib.log.ilog(f"Step {nb_steps}/{nb_steps}: Dependency Linking")
         if deplinker is not None:
-            with stdlib.log.pushlog():
+            with stdlib.log.pushlog(), stdlib.usage.step('dependency_linking'):
                 deplinker(packages)
 
     return packages
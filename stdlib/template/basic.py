@@ -8,6 +8,8 @@ import stdlib
 import stdlib.fetch
 import stdlib.extract
 import stdlib.patch
+import stdlib.snapshot
+import stdlib.usage
 import stdlib.split.system
 import stdlib.deplinker.elf
 
@@ -54,6 +56,9 @@ def build(
 
         This step is used to patch the downloaded source code. The default value is :py:func:`.patch_all` with no argument.
 
+        The extract and patch steps are skipped if the source code they prepared can be restored from a snapshot instead
+        (see :py:func:`stdlib.snapshot.prepare`).
+
     From now on, the current working directory is changed in favor of ``build_folder`` (which defaults to ``.``).
     If the directory pointed by ``build_folder`` doesn't exist, it is created.
 
@@ -90,45 +95,37 @@ def build(
 
     stdlib.log.ilog("Step 1/9: Fetch")
     if fetch is not None:
-        with stdlib.log.pushlog():
+        with stdlib.log.pushlog(), stdlib.usage.step('fetch'):
             fetch()
 
-    stdlib.log.ilog("Step 2/9: Extract")
-    if extract is not None:
-        with stdlib.log.pushlog():
-            extract()
-
-    stdlib.log.ilog("Step 3/9: Patch")
-    if patch is not None:
-        with stdlib.log.pushlog():
-            patch()
+    stdlib.snapshot.prepare(extract, patch, 9)
 
     os.makedirs(build_folder, exist_ok=True)
     with stdlib.pushd(build_folder):
         stdlib.log.ilog("Step 4/9: Configure")
         if configure is not None:
-            with stdlib.log.pushlog():
+            with stdlib.log.pushlog(), stdlib.usage.step('configure'):
                 configure()
 
         stdlib.log.ilog("Step 5/9: Compile")
         if compile is not None:
-            with stdlib.log.pushlog():
+            with stdlib.log.pushlog(), stdlib.usage.step('compile'):
                 compile()
 
         stdlib.log.ilog("Step 6/9: Check")
         if check is not None:
-            with stdlib.log.pushlog():
+            with stdlib.log.pushlog(), stdlib.usage.step('check'):
                 check()
 
         stdlib.log.ilog("Step 7/9: Install")
         if install is not None:
-            with stdlib.log.pushlog(), stdlib.pushenv():
+            with stdlib.log.pushlog(), stdlib.usage.step('install'), stdlib.pushenv():
                 os.environ['DESTDIR'] = build.install_cache
                 install()
 
         stdlib.log.ilog("Step 8/9: Split")
         if split is not None:
-            with stdlib.log.pushlog():
+            with stdlib.log.pushlog(), stdlib.usage.step('split'):
                 packages = split()
 
                 if len(packages) > 0:
@@ -140,7 +137,7 @@ def build(
 
         stdlib.log.ilog("Step 9/9: Dependency Linking")
         if deplinker is not None:
-            with stdlib.log.pushlog():
+            with stdlib.log.pushlog(), stdlib.usage.step('dependency_linking'):
                 deplinker(packages)
 
     return packages
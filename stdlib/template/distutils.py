@@ -8,6 +8,8 @@ import stdlib
 import stdlib.fetch
 import stdlib.extract
 import stdlib.patch
+import stdlib.snapshot
+import stdlib.usage
 import stdlib.split.drain_all
 import stdlib.deplinker.elf
 
@@ -103,6 +105,9 @@ def build(
 
         This step is used to patch the downloaded source code. The default value is :py:func:`.patch_all` with no argument.
 
+        The extract and patch steps are skipped if the source code they prepared can be restored from a snapshot instead
+        (see :py:func:`stdlib.snapshot.prepare`).
+
     **Build**
 
         This step compiles the source code. The default value is :py:func:`.distutils_build`, with no argument.
@@ -127,37 +132,29 @@ def build(
     """
     stdlib.log.ilog("Step 1/8: Fetch")
     if fetch is not None:
-        with stdlib.log.pushlog():
+        with stdlib.log.pushlog(), stdlib.usage.step('fetch'):
             fetch()
 
-    stdlib.log.ilog("Step 2/8: Extract")
-    if extract is not None:
-        with stdlib.log.pushlog():
-            extract()
-
-    stdlib.log.ilog("Step 3/8: Patch")
-    if patch is not None:
-        with stdlib.log.pushlog():
-            patch()
+    stdlib.snapshot.prepare(extract, patch, 8)
 
     stdlib.log.ilog("Step 4/8: Build")
     if build is not None:
-        with stdlib.log.pushlog():
+        with stdlib.log.pushlog(), stdlib.usage.step('build'):
             build()
 
     stdlib.log.ilog("Step 5/8: Check")
     if check is not None:
-        with stdlib.log.pushlog():
+        with stdlib.log.pushlog(), stdlib.usage.step('check'):
             check()
 
     stdlib.log.ilog("Step 6/8: Install")
     if install is not None:
-        with stdlib.log.pushlog(), stdlib.pushenv():
+        with stdlib.log.pushlog(), stdlib.usage.step('install'), stdlib.pushenv():
             install()
 
     stdlib.log.ilog("Step 7/8: Split")
     if split is not None:
-        with stdlib.log.pushlog():
+        with stdlib.log.pushlog(), stdlib.usage.step('split'):
             packages = split()
 
             if len(packages) > 0:
@@ -169,7 +166,7 @@ def build(
 
     stdlib.log.ilog("Step 8/8: Dependency Linking")
     if deplinker is not None:
-        with stdlib.log.pushlog():
+        with stdlib.log.pushlog(), stdlib.usage.step('dependency_linking'):
             deplinker(packages)
 
     return packages
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3.6
+# -*- coding: utf-8 -*-
+"""Types and functions to account for the resources used by the commands of a build.
+
+The resources used by each command executed by :py:func:`~stdlib.cmd.cmd` (and all the processes it waited for) are recorded in the
+current build, along with the step of the template it was executed in (see :py:func:`.step`). Once the packages of a build are
+wrapped, they are summed up per step and for the whole build in a report, written next to the ``.nest`` files
+(see :py:func:`~core.cache.get_report_path`).
+"""
+
+import os
+import toml
+import threading
+import collections
+import stdlib.build
+from contextlib import contextmanager
+from typing import Optional
+from core.cache import get_report_path
+
+_steps = threading.local()
+
+
+class Usage():
+    """The resources used by one or more commands.
+
+    :ivar commands: The number of commands.
+    :vartype commands: ``int``
+
+    :ivar wall_time: The time elapsed while the commands were running, in seconds.
+    :vartype wall_time: ``float``
+
+    :ivar user_time: The CPU time spent in user mode, in seconds.
+    :vartype user_time: ``float``
+
+    :ivar system_time: The CPU time spent in kernel mode, in seconds.
+    :vartype system_time: ``float``
+
+    :ivar max_rss: The largest resident set size of a process of the commands, in kibibytes. It includes the memory used by ``nbuild``
+        itself, as each command starts as a fork of it.
+    :vartype max_rss: ``int``
+
+    :ivar read_blocks: The number of blocks read from the file systems.
+    :vartype read_blocks: ``int``
+
+    :ivar written_blocks: The number of blocks written to the file systems.
+    :vartype written_blocks: ``int``
+
+    :ivar voluntary_switches: The number of times a process gave up the CPU, usually to wait for a resource.
+    :vartype voluntary_switches: ``int``
+
+    :ivar involuntary_switches: The number of times a process was preempted by the scheduler.
+    :vartype involuntary_switches: ``int``
+    """
+    def __init__(self):
+        self.commands = 0
+        self.wall_time = 0.0
+        self.user_time = 0.0
+        self.system_time = 0.0
+        self.max_rss = 0
+        self.read_blocks = 0
+        self.written_blocks = 0
+        self.voluntary_switches = 0
+        self.involuntary_switches = 0
+
+    @staticmethod
+    def from_rusage(rusage, wall_time: float):
+        """Create the :py:class:`.Usage` of a single command.
+
+        :param rusage: The resources used by the command, as returned by ``os.wait4()``.
+        :type rusage: ``resource.struct_rusage``
+        :param wall_time: The time elapsed while the command was running, in seconds.
+        """
+        usage = Usage()
+        usage.commands = 1
+        usage.wall_time = wall_time
+        usage.user_time = rusage.ru_utime
+        usage.system_time = rusage.ru_stime
+        usage.max_rss = rusage.ru_maxrss
+        usage.read_blocks = rusage.ru_inblock
+        usage.written_blocks = rusage.ru_oublock
+        usage.voluntary_switches = rusage.ru_nvcsw
+        usage.involuntary_switches = rusage.ru_nivcsw
+        return usage
+
+    def add(self, other):
+        """Add the resources used by ``other`` to ``self``.
+
+        :info: The largest resident set size is kept, instead of summed, as the commands didn't run at the same time.
+        :param other: The resources to add.
+        :type other: :py:class:`.Usage`
+        """
+        self.commands += other.commands
+        self.wall_time += other.wall_time
+        self.user_time += other.user_time
+        self.system_time += other.system_time
+        self.max_rss = max(self.max_rss, other.max_rss)
+        self.read_blocks += other.read_blocks
+        self.written_blocks += other.written_blocks
+        self.voluntary_switches += other.voluntary_switches
+        self.involuntary_switches += other.involuntary_switches
+
+    def to_dict(self):
+        """Return the resources used as a dictionary, with times rounded to the millisecond."""
+        return {
+            'commands': self.commands,
+            'wall_time': round(self.wall_time, 3),
+            'user_time': round(self.user_time, 3),
+            'system_time': round(self.system_time, 3),
+            'max_rss': self.max_rss,
+            'read_blocks': self.read_blocks,
+            'written_blocks': self.written_blocks,
+            'voluntary_switches': self.voluntary_switches,
+            'involuntary_switches': self.involuntary_switches,
+        }
+
+    def __str__(self):
+        return f'{self.user_time:.2f}s user, {self.system_time:.2f}s system, {self.max_rss // 1024} MiB max RSS'
+
+
+@contextmanager
+def step(name: str):
+    """Account the resources used by the commands executed in the new context to the step named ``name``.
+
+    This is used by the templates (see :py:mod:`stdlib.template`) to break the report down by step. Commands executed outside of any
+    step are only accounted to the whole build.
+
+    :info: The step is specific to the current thread.
+    :param name: The name of the step, like ``configure`` or ``compile``.
+    """
+    old_step = current_step()
+    _steps.name = name
+    try:
+        yield
+    finally:
+        _steps.name = old_step
+
+
+def current_step() -> Optional[str]:
+    """Return the name of the step the commands of the current thread are accounted to, or ``None`` if there is none."""
+    return getattr(_steps, 'name', None)
+
+
+def record(
+    command: str,
+    usage: Usage,
+):
+    """Record the resources used by ``command`` in the current build, if there is one.
+
+    :param command: The command that was executed.
+    :param usage: The resources it used.
+    :type usage: :py:class:`.Usage`
+    """
+    build = stdlib.build.current_build()
+    if build is not None:
+        build.usage.append((current_step(), command, usage))
+
+
+def write_report(build):
+    """Write the report of the resources used by the commands of ``build``, as a TOML file.
+
+    The report has a ``total`` table, for the whole build, a ``steps`` array of tables, one per step (in the order they were first
+    executed) and a ``commands`` array of tables, one per command.
+
+    :param build: The build to write the report of.
+    :type build: :py:class:`.Build`
+    :returns: The path of the report.
+    """
+    total = Usage()
+    steps = collections.OrderedDict()
+    commands = list()
+
+    for (step_name, command, usage) in build.usage:
+        total.add(usage)
+        if step_name is not None:
+            steps.setdefault(step_name, Usage()).add(usage)
+        commands.append({'command': command, 'step': step_name or '', **usage.to_dict()})
+
+    report = {
+        'name': build.manifest.metadata.name,
+        'category': build.manifest.metadata.category,
+        'version': build.semver,
+        'total': total.to_dict(),
+        'steps': [{'name': name, **usage.to_dict()} for (name, usage) in steps.items()],
+        'commands': commands,
+    }
+
+    path = get_report_path(build)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as file:
+        toml.dump(report, file)
+    return path